@@ -0,0 +1,224 @@
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+import numpy as np
+
+import buildcache
+import datfile
+import perfstats
+import synthetic
+import xtime
+
+# Benchmark suite on a synthetic workload (synthetic.py): every stage of the pipeline (parsing, conversion, .dat
+# reading, diff screening, rendering, animation) is timed on the same generated files. Results (best wall time of
+# repeat runs, stage breakdown from perfstats, digest of the outputs) are written as JSON and can be compared with
+# a stored baseline: a benchmark is a regression if it is more than tolerance slower than the baseline, or if its
+# output digest changed (the workload is deterministic).
+
+# size of the synthetic workload, stored with the results (baselines are only comparable for the same workload):
+WORKLOAD = {'timesteps': 100, 'isotopes': 2000, 'DIM_N': 160, 'DIM_Z': 110, 'runs': 2, 'reference': 20, 'perturbation': 0.3, 'seed': 1}
+
+# frames rendered by the matplotlib benchmark (slow, a subset is enough)
+MATPLOTLIB_FRAMES = 10
+
+
+def grid_digest(grids):
+    # digest over a sequence of (timestep, grid)
+    return buildcache.frame_digest(*(np.ascontiguousarray(grid).tobytes() for timestep, grid in grids))
+
+
+def bench_parse(files, work_dir):
+    # parse and rasterize the text file of run 0
+    path = files['text'][0]
+    origin_N, origin_Z, DIM_N, DIM_Z = xtime.grid_extent(xtime.scan_extent(path, 1))
+    frames = [(timestep, grid) for timestep, header, grid in xtime.iter_timesteps(path, DIM_N, DIM_Z, origin_N=origin_N, origin_Z=origin_Z)]
+    return len(frames), grid_digest(frames)
+
+
+def bench_convert(files, work_dir):
+    # plot2D_to_binary.OpenTimeSeries on a copy of the text file of run 0 in work_dir/convert/ (the generated .dat
+    # files are not touched)
+    import shutil
+    import plot2D_to_binary
+    name = os.path.basename(files['text'][0])
+    convert_dir = os.path.join(work_dir, 'convert')
+    if not os.path.exists(os.path.join(convert_dir, plot2D_to_binary.path_time_series)):
+        os.makedirs(os.path.join(convert_dir, plot2D_to_binary.path_time_series))
+    shutil.copy(files['text'][0], convert_dir)
+
+    path = os.path.join(convert_dir, name)
+    plot2D_to_binary.OpenTimeSeries(path)
+    dat = datfile.DatFile(os.path.join(convert_dir, plot2D_to_binary.path_time_series, name[:-4]+'.dat'))
+    return len(dat), grid_digest(dat[i] for i in range(len(dat)))
+
+
+def bench_follow(files, work_dir):
+    # follow.TimeSeriesFollower on a copy of the text file of run 0 in work_dir/follow/, read in chunks of a fifth of
+    # the file (a backlog of several chunks has to be converted by one poll). Fails if a frame is missing.
+    import shutil
+    import follow
+    name = os.path.basename(files['text'][0])
+    follow_dir = os.path.join(work_dir, 'follow')
+    output_dir = os.path.join(follow_dir, 'time2D_bin')
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    shutil.copy(files['text'][0], follow_dir)
+    path = os.path.join(follow_dir, name)
+    dat_path = os.path.join(output_dir, name[:-4]+'.dat')
+    if os.path.exists(dat_path):
+        os.remove(dat_path)
+
+    follower = follow.TimeSeriesFollower(path, output_dir, chunk_size=os.path.getsize(path)//5)
+    frames = follower.poll(final=True)
+    follower.close()
+    dat = datfile.DatFile(dat_path)
+    if frames != WORKLOAD['timesteps'] or len(dat) != WORKLOAD['timesteps']:
+        raise RuntimeError("follow: "+str(len(dat))+" of "+str(WORKLOAD['timesteps'])+" frames converted")
+    return len(dat), grid_digest(dat[i] for i in range(len(dat)))
+
+
+def bench_read_dat(files, work_dir):
+    # read every frame of run 0 through plot2D_diff.ReadDataFromFile
+    import plot2D_diff
+    with open(files['dat'][0], 'rb') as f:
+        frames = [(timestep, np.array(grid)) for timestep, grid in plot2D_diff.ReadDataFromFile(f, 0, 0)]
+    return len(frames), grid_digest(frames)
+
+
+def bench_compare(files, work_dir):
+    # plot2D_diff.CompareTimeSeries run 0 vs run 1, screening only (diff_report.csv)
+    import plot2D_diff
+    path_out = os.path.join(work_dir, 'compare')
+    plot2D_diff.CompareTimeSeries(files['dat'][0], files['dat'][1], files['reference_isotopes'], path_out, 0, 1.0, 0.0, WORKLOAD['DIM_N'], WORKLOAD['DIM_Z'], render=False)
+    return len(datfile.DatFile(files['dat'][0])), buildcache.file_digest(os.path.join(path_out, 'diff_report.csv'))
+
+
+def bench_render_diff(files, work_dir):
+    # plot2D_diff.CompareTimeSeries run 0 vs run 1, every frame rendered with the raster backend
+    import plot2D_diff
+    path_out = os.path.join(work_dir, 'render_diff')
+    plot2D_diff.CompareTimeSeries(files['dat'][0], files['dat'][1], files['reference_isotopes'], path_out, 0, 1.0, 0.0, WORKLOAD['DIM_N'], WORKLOAD['DIM_Z'], backend='raster')
+    return len(datfile.DatFile(files['dat'][0])), None
+
+
+def bench_render_matplotlib(files, work_dir):
+    # plot2D.PlotTimeSeries of the first MATPLOTLIB_FRAMES frames of run 0 (matplotlib figures)
+    import plot2D
+    path_output = os.path.join(work_dir, 'render_matplotlib')+'/'
+    if not os.path.exists(path_output):
+        os.makedirs(path_output)
+    dat = datfile.DatFile(files['dat'][0])
+    frames = np.arange(min(MATPLOTLIB_FRAMES, len(dat)))
+    plot2D.PlotTimeSeries(datfile.iter_timesteps(files['dat'][0], frames), 'XTime_synth_0', path_output, dat.origin_N, dat.origin_Z)
+    return len(frames), None
+
+
+def bench_animate(files, work_dir):
+    # make_anim.create_video of the raster diff frames of render_diff (see DEPENDENCIES)
+    import make_anim
+    input_folder = os.path.join(work_dir, 'render_diff')
+    make_anim.create_video(input_folder, os.path.join(work_dir, 'diff.mp4'), 1/30, 100000)
+    return len(make_anim.png_paths(input_folder, 100000)), None
+
+
+BENCHMARKS = [('parse', bench_parse), ('convert', bench_convert), ('follow', bench_follow), ('read_dat', bench_read_dat), ('compare', bench_compare),
+              ('render_diff', bench_render_diff), ('render_matplotlib', bench_render_matplotlib), ('animate', bench_animate)]
+
+# benchmarks that work on the output of others (they are run before them, also with --only):
+DEPENDENCIES = {'animate': ['render_diff']}
+
+
+def run_benchmarks(work_dir, repeat=3, only=None):
+    # generate the workload in work_dir and run the benchmarks (all, or the names in only), returns the results
+    files = synthetic.generate(work_dir, **WORKLOAD)
+    if only:
+        only = set(only)
+        for name in list(only):
+            only.update(DEPENDENCIES.get(name, []))
+
+    results = {}
+    for name, function in BENCHMARKS:
+        if only and name not in only:
+            continue
+        print("Benchmark",name,"...        ", end="\r", flush=True)
+
+        best = None
+        for i in range(repeat):
+            perfstats.stages.clear()
+            # progress output of the scripts is dropped:
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                frames, digest = function(files, work_dir)
+                seconds = time.perf_counter() - start
+            if best is None or seconds < best['seconds']:
+                best = {'seconds': seconds, 'frames': frames, 'per_frame': seconds / max(frames, 1), 'digest': digest,
+                        'stages': {stage: round(entry['wall'], 6) for stage, entry in perfstats.stages.items()}}
+
+        results[name] = best
+        print("Benchmark",name,":",round(best['seconds'], 3),"s (",round(1000*best['per_frame'], 2),"ms per frame,",frames,"frames)        ")
+
+    return {'workload': WORKLOAD, 'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+            'cpus': os.cpu_count(), 'results': results}
+
+
+def compare_results(current, baseline, tolerance):
+    # print the comparison with a baseline, returns the names of the regressed benchmarks
+    if current['workload'] != baseline['workload']:
+        print("Error: The baseline was recorded with a different workload:",baseline['workload'])
+        return ['workload']
+
+    regressions = []
+    for name, result in current['results'].items():
+        if name not in baseline['results']:
+            print("  ",name,": not in baseline")
+            continue
+        reference = baseline['results'][name]
+        ratio = result['seconds'] / reference['seconds']
+        status = "ok"
+        if result['digest'] != reference['digest']:
+            status = "OUTPUT CHANGED"
+            regressions.append(name)
+        elif ratio > 1 + tolerance:
+            status = "SLOWER"
+            regressions.append(name)
+        print("  ",name,":",round(result['seconds'], 3),"s vs",round(reference['seconds'], 3),"s (x",round(ratio, 2),")",status)
+    return regressions
+
+
+# main method, read work folder and options from command line arguments
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Time every stage of the pipeline on a synthetic workload and compare with a baseline.')
+    parser.add_argument('work_dir', type=str, help='Folder for the generated workload and the outputs.')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per benchmark, the fastest is kept.')
+    parser.add_argument('--only', type=str, nargs='+', default=None, choices=[name for name, function in BENCHMARKS], help='Run only these benchmarks.')
+    parser.add_argument('--output', type=str, default=None, help='Write the results (JSON) to this file.')
+    parser.add_argument('--baseline', type=str, default=None, help='Compare with the results stored in this file, exit with 1 on regressions.')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown against the baseline (0.25 = 25%%).')
+    for key, value in WORKLOAD.items():
+        parser.add_argument('--'+key, type=type(value), default=value, help='Workload: '+key+' (see synthetic.py).')
+    args = parser.parse_args()
+
+    for key in WORKLOAD:
+        WORKLOAD[key] = getattr(args, key)
+
+    current = run_benchmarks(args.work_dir, args.repeat, args.only)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=1, sort_keys=True)
+        print("Results written to",args.output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print("Comparison with",args.baseline,"(tolerance",str(round(100*args.tolerance))+"%):")
+        regressions = compare_results(current, baseline, args.tolerance)
+        if regressions:
+            print("Regressions:",', '.join(regressions))
+            sys.exit(1)
+        print("No regressions.")
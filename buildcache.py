@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+
+# Make-style rebuild cache for conversion and rendering.
+#
+# A manifest (JSON, stored in the output directory) records for every input file its size, mtime and content hash,
+# the parameters that were used (dimensions, color range, dpi, ...), the output files and, for rendering, a digest of
+# every frame. A file is skipped if its parameters are unchanged, its outputs exist and size/mtime (or, if those
+# changed, the content hash) match. Frames of changed files are skipped individually if their digest is unchanged.
+
+MANIFEST_NAME = '.prism_manifest.json'
+
+
+def file_digest(path):
+    # content hash of a file, read in chunks
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(8*1024*1024)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def frame_digest(*parts):
+    # digest of the bytes that make up one frame (text block or grid)
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class Manifest:
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    self.entries = json.load(f).get('files', {})
+            except (OSError, ValueError):
+                print("Warning: Ignoring unreadable manifest",self.path)
+
+    def save(self):
+        # write to a temporary file first, so an interrupted run never leaves a broken manifest
+        with open(self.path+'.tmp', 'w') as f:
+            json.dump({'files': self.entries}, f, indent=1, sort_keys=True)
+        os.replace(self.path+'.tmp', self.path)
+
+    def is_current(self, input_path, params):
+        # True if input_path was processed with params before, its outputs exist and the input is unchanged
+        entry = self.entries.get(os.path.abspath(input_path))
+        if entry is None or entry['params'] != params:
+            return False
+        if not all(os.path.exists(output) for output in entry['outputs']):
+            return False
+
+        stat = os.stat(input_path)
+        if entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return True
+
+        # only touched? compare content:
+        if entry['size'] == stat.st_size and entry['hash'] == file_digest(input_path):
+            entry['mtime_ns'] = stat.st_mtime_ns
+            return True
+        return False
+
+    def frames(self, input_path, params):
+        # frame digests of the last run ({timestep: digest}), empty if the parameters changed
+        entry = self.entries.get(os.path.abspath(input_path))
+        if entry is None or entry['params'] != params:
+            return {}
+        return {int(timestep): digest for timestep, digest in entry.get('frames', {}).items()}
+
+    def record(self, input_path, params, outputs, frames=None):
+        # remember a completed run
+        stat = os.stat(input_path)
+        self.entries[os.path.abspath(input_path)] = {
+            'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': file_digest(input_path),
+            'params': params, 'outputs': [os.path.abspath(output) for output in outputs],
+            'frames': {str(timestep): digest for timestep, digest in (frames or {}).items()}}
+
+    def entry(self, input_path):
+        return self.entries.get(os.path.abspath(input_path))
+
+    def merge(self, input_path, entry):
+        # take over the entry of a file that was processed by a worker process
+        if entry is not None:
+            self.entries[os.path.abspath(input_path)] = entry
+
+
+def largest_first(paths):
+    # schedule big files first, so a pool is not left waiting for one big file at the end
+    return sorted(paths, key=lambda path: -os.path.getsize(path))
+
+
+def _run_task(function, task):
+    # worker: function(task) with its output captured, returns (result, output, error). Progress lines ("\r") are
+    # reduced to their last state, so the output of parallel files does not interleave.
+    import contextlib
+    import io
+    import traceback
+
+    output = io.StringIO()
+    result = error = None
+    with contextlib.redirect_stdout(output):
+        try:
+            result = function(task)
+        except Exception as exception:
+            error = repr(exception)
+            traceback.print_exc(file=output)
+    lines = [line.split('\r')[-1].rstrip() for line in output.getvalue().split('\n')]
+    return result, '\n'.join(line for line in lines if line), error
+
+
+def run_batch(function, tasks, jobs=1):
+    # run function(task) for every task, with jobs > 1 in worker processes (tasks are started in the given order, jobs
+    # at a time). Yields (task, result, output, error) as tasks complete, error is None on success. Every task gets a
+    # worker process of its own, so an exception or a crashed worker (e.g. killed when out of memory) only fails its
+    # own task. Serially, the output is printed as usual (output is empty then).
+    if jobs <= 1:
+        import traceback
+        for task in tasks:
+            result = error = None
+            try:
+                result = function(task)
+            except Exception as exception:
+                error = repr(exception)
+                traceback.print_exc()
+            yield task, result, '', error
+        return
+
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+    pending = list(tasks)
+    running = {}
+    try:
+        while pending or running:
+            while pending and len(running) < jobs:
+                task = pending.pop(0)
+                pool = ProcessPoolExecutor(max_workers=1)
+                running[pool.submit(_run_task, function, task)] = (task, pool)
+
+            for future in wait(running, return_when=FIRST_COMPLETED).done:
+                task, pool = running.pop(future)
+                pool.shutdown()
+                try:
+                    result, output, error = future.result()
+                except Exception as exception:
+                    result, output, error = None, '', repr(exception)
+                yield task, result, output, error
+    finally:
+        for task, pool in running.values():
+            pool.shutdown(cancel_futures=True)
@@ -0,0 +1,491 @@
+import json
+import os
+import struct
+import zlib
+import numpy as np
+
+import frametable
+
+# Binary time series files written by plot2D_to_binary.py.
+#
+# Version 2 layout (little endian):
+# header (HEADER_SIZE bytes): magic b'PRISMDAT', version, flags, DIM_N, DIM_Z, value dtype, frame count,
+#                             offset of the frame directory, offset of the first frame, length and capacity of the
+#                             metadata block, origin_N, origin_Z, zero padding
+#                             The grid covers N = origin_N .. origin_N+DIM_N-1 and Z = origin_Z .. origin_Z+DIM_Z-1.
+# metadata block: JSON (source file, fill value, ...), padded to its capacity
+# frames: record header (tag b'FRME', timestep int32, payload bytes uint32) + DIM_Z x DIM_N float32
+# sparse files (flag FLAG_SPARSE) instead contain
+#   index sets: record header (tag b'NIDX', set number) + sorted flat cell indices (Z*DIM_N + N) as int32
+#   frames:     record header (tag b'SPRS', timestep) + float32 values of the cells of the last index set
+#   Only populated cells are stored. A new index set is written only when a frame populates a cell outside the
+#   current set (the new set is the union), so most runs store a handful of index sets.
+# frame directory: tag b'PDIR', entry count, crc32 of the entries, then one entry per frame
+#                  (timestep, kind, offset of the record, aux)
+#
+# New frames are appended over the old directory, then the new directory and finally the header are written. The
+# header is the commit point: if a write is interrupted, the directory is missing or fails its checksum and the
+# frames are recovered by scanning the records (see scan_records). recover() ("prism.py query --repair") writes the
+# recovered directory back.
+#
+# Version 1 (legacy) layout, still readable:
+# header: DIM_N (int32), DIM_Z (int32)
+# frames: timestep (int32), DIM_Z x DIM_N log10 abundances (float32), repeated until EOF
+
+MAGIC = b'PRISMDAT'
+VERSION = 2
+
+HEADER_SIZE = 128
+HEADER_STRUCT = struct.Struct('<8sIIii4sQQQIIii')
+
+METADATA_CAPACITY = 4096
+
+LEGACY_HEADER_SIZE = 8
+
+TAG_FRAME = b'FRME'
+TAG_SPARSE_FRAME = b'SPRS'
+TAG_INDEX_SET = b'NIDX'
+TAG_DIRECTORY = b'PDIR'
+
+# header flags:
+FLAG_SPARSE = 1
+
+# value of cells that are not stored in sparse files (if the metadata has no fill_value):
+DEFAULT_FILL_VALUE = -15.0
+
+RECORD_HEADER_DTYPE = np.dtype([('tag', 'S4'), ('timestep', '<i4'), ('nbytes', '<u4')])
+DIRECTORY_HEADER_STRUCT = struct.Struct('<4sII')
+DIRECTORY_DTYPE = np.dtype([('timestep', '<i4'), ('kind', '<u4'), ('offset', '<u8'), ('aux', '<u8')])
+
+# directory entry kinds (aux: offset of the index set record for sparse frames):
+KIND_DENSE = 0
+KIND_SPARSE = 1
+
+
+def read_header(file):
+    # read the header of an open file, returns dict with 'version', 'DIM_N', 'DIM_Z', 'data_offset' and (version 2)
+    # the other layout fields. The file is left positioned at the first frame.
+    start = file.read(LEGACY_HEADER_SIZE)
+    if start != MAGIC:
+        # legacy file: only the dimensions
+        file.seek(LEGACY_HEADER_SIZE)
+        return {'version': 1,
+                'DIM_N': int.from_bytes(start[:4], byteorder='little', signed=True),
+                'DIM_Z': int.from_bytes(start[4:8], byteorder='little', signed=True),
+                'origin_N': 0, 'origin_Z': 0,
+                'data_offset': LEGACY_HEADER_SIZE}
+
+    file.seek(0)
+    (magic, version, flags, DIM_N, DIM_Z, dtype, frame_count, dir_offset, data_offset, meta_length, meta_capacity, origin_N, origin_Z) = HEADER_STRUCT.unpack(file.read(HEADER_STRUCT.size))
+    if version != VERSION:
+        raise ValueError("Unsupported .dat version "+str(version))
+
+    file.seek(HEADER_SIZE)
+    metadata = json.loads(file.read(meta_length).decode()) if meta_length > 0 else {}
+
+    file.seek(data_offset)
+    return {'version': version, 'flags': flags, 'DIM_N': DIM_N, 'DIM_Z': DIM_Z, 'origin_N': origin_N, 'origin_Z': origin_Z, 'dtype': dtype.rstrip(b'\0').decode(),
+            'frame_count': frame_count, 'dir_offset': dir_offset, 'data_offset': data_offset,
+            'meta_length': meta_length, 'meta_capacity': meta_capacity, 'metadata': metadata}
+
+
+def pack_header(header):
+    packed = HEADER_STRUCT.pack(MAGIC, VERSION, header['flags'], header['DIM_N'], header['DIM_Z'], header['dtype'].encode(),
+                                header['frame_count'], header['dir_offset'], header['data_offset'],
+                                header['meta_length'], header['meta_capacity'], header['origin_N'], header['origin_Z'])
+    return packed + bytes(HEADER_SIZE - len(packed))
+
+
+def frame_size(DIM_N, DIM_Z, version=VERSION):
+    # bytes per dense frame: record header (version 1: timestep only) + grid
+    if version == 1:
+        return 4 + DIM_N*DIM_Z*4
+    return RECORD_HEADER_DTYPE.itemsize + DIM_N*DIM_Z*4
+
+
+def read_directory(file, header):
+    # frame directory of a version 2 file, None if it is missing or damaged (e.g. interrupted write)
+    file.seek(header['dir_offset'])
+    directory_header = file.read(DIRECTORY_HEADER_STRUCT.size)
+    if len(directory_header) < DIRECTORY_HEADER_STRUCT.size:
+        return None
+
+    tag, count, checksum = DIRECTORY_HEADER_STRUCT.unpack(directory_header)
+    if tag != TAG_DIRECTORY or count != header['frame_count']:
+        return None
+
+    entries = file.read(count*DIRECTORY_DTYPE.itemsize)
+    if len(entries) < count*DIRECTORY_DTYPE.itemsize or zlib.crc32(entries) != checksum:
+        return None
+
+    return np.frombuffer(entries, dtype=DIRECTORY_DTYPE).copy()
+
+
+def scan_records(file, header):
+    # rebuild the frame directory by walking the records from the first frame on, stops at the first incomplete or
+    # unknown record. Returns (directory, end offset of the last complete record).
+    size = os.fstat(file.fileno()).st_size
+    entries = []
+    offset = header['data_offset']
+    index_offset = 0
+    while offset + RECORD_HEADER_DTYPE.itemsize <= size:
+        file.seek(offset)
+        record = np.frombuffer(file.read(RECORD_HEADER_DTYPE.itemsize), dtype=RECORD_HEADER_DTYPE)[0]
+        end = offset + RECORD_HEADER_DTYPE.itemsize + int(record['nbytes'])
+        if end > size:
+            break
+
+        if record['tag'] == TAG_FRAME:
+            entries.append( (int(record['timestep']), KIND_DENSE, offset, 0) )
+        elif record['tag'] == TAG_SPARSE_FRAME:
+            entries.append( (int(record['timestep']), KIND_SPARSE, offset, index_offset) )
+        elif record['tag'] == TAG_INDEX_SET:
+            index_offset = offset
+        else:
+            break
+        offset = end
+
+    return np.array(entries, dtype=DIRECTORY_DTYPE), offset
+
+
+def read_record(file, offset, dtype):
+    # payload of the record at offset as array of dtype
+    file.seek(offset)
+    record = np.frombuffer(file.read(RECORD_HEADER_DTYPE.itemsize), dtype=RECORD_HEADER_DTYPE)[0]
+    return np.frombuffer(file.read(int(record['nbytes'])), dtype=dtype)
+
+
+def write_directory(file, header, directory):
+    # write the directory at header['dir_offset'], then the header (commit point)
+    entries = directory.astype(DIRECTORY_DTYPE).tobytes()
+    file.seek(header['dir_offset'])
+    file.write(DIRECTORY_HEADER_STRUCT.pack(TAG_DIRECTORY, len(directory), zlib.crc32(entries)))
+    file.write(entries)
+    file.truncate()
+    file.flush()
+
+    header['frame_count'] = len(directory)
+    file.seek(0)
+    file.write(pack_header(header))
+    file.flush()
+
+
+def recover(path):
+    # make a partially written file consistent again: keep all complete frames, drop the rest and write a new
+    # directory. Returns the number of frames.
+    with open(path, 'r+b') as file:
+        header = read_header(file)
+        if header['version'] == 1:
+            # legacy files have no directory, cut off an incomplete last frame:
+            count = (os.path.getsize(path) - LEGACY_HEADER_SIZE) // frame_size(header['DIM_N'], header['DIM_Z'], 1)
+            file.truncate(LEGACY_HEADER_SIZE + count*frame_size(header['DIM_N'], header['DIM_Z'], 1))
+            return count
+
+        directory, end = scan_records(file, header)
+        header['dir_offset'] = end
+        write_directory(file, header, directory)
+        return len(directory)
+
+
+class DatWriter:
+    # writes a version 2 file frame by frame. With append=True, frames are added to an existing file without
+    # rewriting it (only the directory at the end and the header are replaced). With sparse=True only the populated
+    # cells (value != fill_value) are stored, see the layout description above.
+    def __init__(self, path, DIM_N, DIM_Z, metadata=None, append=False, sparse=False, fill_value=DEFAULT_FILL_VALUE, origin_N=0, origin_Z=0):
+        self.path = path
+
+        # current index set of sparse files: sorted flat cell indices, mask over all cells and offset of its record
+        self.index = None
+        self.index_mask = None
+        self.index_offset = 0
+        self.index_count = 0
+
+        if append and os.path.exists(path):
+            self.file = open(path, 'r+b')
+            self.header = read_header(self.file)
+            if self.header['version'] == 1:
+                self.file.close()
+                raise ValueError("Can't append to legacy (version 1) file "+path)
+            if (self.header['DIM_N'], self.header['DIM_Z'], self.header['origin_N'], self.header['origin_Z']) != (DIM_N, DIM_Z, origin_N, origin_Z):
+                self.file.close()
+                raise ValueError("Dimensions of "+path+" do not match")
+
+            directory = read_directory(self.file, self.header)
+            if directory is None:
+                # interrupted earlier write: continue after the last complete frame
+                directory, self.header['dir_offset'] = scan_records(self.file, self.header)
+            self.entries = directory.tolist()
+            self.end = self.header['dir_offset']
+            self.sparse = bool(self.header['flags'] & FLAG_SPARSE)
+            self.fill_value = self.header['metadata'].get('fill_value', DEFAULT_FILL_VALUE)
+
+            # continue with the index set of the last frame:
+            if self.sparse and len(directory) > 0:
+                self._set_index(read_record(self.file, int(directory['aux'][-1]), '<i4'), int(directory['aux'][-1]))
+                self.index_count = len(np.unique(directory['aux']))
+            return
+
+        self.sparse = sparse
+        self.fill_value = fill_value
+
+        metadata = dict(metadata) if metadata is not None else {}
+        if sparse:
+            metadata['fill_value'] = fill_value
+
+        metadata_bytes = json.dumps(metadata).encode()
+        if len(metadata_bytes) > METADATA_CAPACITY:
+            raise ValueError("Metadata exceeds "+str(METADATA_CAPACITY)+" bytes")
+
+        self.file = open(path, 'w+b')
+        self.header = {'flags': FLAG_SPARSE if sparse else 0, 'DIM_N': DIM_N, 'DIM_Z': DIM_Z, 'origin_N': origin_N, 'origin_Z': origin_Z, 'dtype': '<f4', 'frame_count': 0,
+                       'data_offset': HEADER_SIZE + METADATA_CAPACITY, 'dir_offset': HEADER_SIZE + METADATA_CAPACITY,
+                       'meta_length': len(metadata_bytes), 'meta_capacity': METADATA_CAPACITY}
+        self.file.write(pack_header(self.header))
+        self.file.write(metadata_bytes + bytes(METADATA_CAPACITY - len(metadata_bytes)))
+        self.entries = []
+        self.end = self.header['data_offset']
+        self.commit()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _write_record(self, tag, number, payload):
+        # write a record at the end of the data, returns its offset
+        offset = self.end
+        record = np.array([(tag, number, len(payload))], dtype=RECORD_HEADER_DTYPE).tobytes()
+
+        self.file.seek(offset)
+        self.file.write(record)
+        self.file.write(payload)
+        self.end += len(record) + len(payload)
+        return offset
+
+    def _set_index(self, index, offset):
+        self.index = index
+        self.index_mask = np.zeros(self.header['DIM_N']*self.header['DIM_Z'], dtype=bool)
+        self.index_mask[index] = True
+        self.index_offset = offset
+
+    def write_frame(self, timestep, grid):
+        values = np.ascontiguousarray(grid, dtype='<f4').reshape(-1)
+
+        if not self.sparse:
+            offset = self._write_record(TAG_FRAME, timestep, values.tobytes())
+            self.entries.append( (timestep, KIND_DENSE, offset, 0) )
+            return
+
+        # a new index set is needed if the frame populates cells outside the current one:
+        populated = values != self.fill_value
+        if self.index is None or np.any(populated & ~self.index_mask):
+            if self.index is not None:
+                populated |= self.index_mask
+            index = np.flatnonzero(populated).astype('<i4')
+            self._set_index(index, self._write_record(TAG_INDEX_SET, self.index_count, index.tobytes()))
+            self.index_count += 1
+
+        offset = self._write_record(TAG_SPARSE_FRAME, timestep, values[self.index].tobytes())
+        self.entries.append( (timestep, KIND_SPARSE, offset, self.index_offset) )
+
+    def commit(self):
+        # write directory and header, everything written so far is visible to readers afterwards
+        self.header['dir_offset'] = self.end
+        write_directory(self.file, self.header, np.array(self.entries, dtype=DIRECTORY_DTYPE))
+
+    def close(self):
+        if self.file is not None:
+            self.commit()
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class SparseFrames:
+    # (T, Z, N) frame access for sparse files: frames[i] or frames[list of indices] return dense float32 grids. Frames
+    # that share an index set are densified together with one scatter.
+    def __init__(self, raw, directory, DIM_N, DIM_Z, fill_value):
+        self.raw = raw
+        self.directory = directory
+        self.DIM_N = DIM_N
+        self.DIM_Z = DIM_Z
+        self.fill_value = fill_value
+        self.shape = (len(directory), DIM_Z, DIM_N)
+        self._index_sets = {}
+
+    def __len__(self):
+        return len(self.directory)
+
+    def _payload(self, offset, dtype):
+        # payload of the record at offset as view into the mapped file
+        start = offset + RECORD_HEADER_DTYPE.itemsize
+        nbytes = int(self.raw[start-4:start].view('<u4')[0])
+        return self.raw[start:start+nbytes].view(dtype)
+
+    def _index_set(self, offset):
+        if offset not in self._index_sets:
+            self._index_sets[offset] = np.array(self._payload(offset, '<i4'))
+        return self._index_sets[offset]
+
+    def densify(self, indices):
+        # dense (len(indices), DIM_Z, DIM_N) array of the given frames
+        indices = np.asarray(indices, dtype=np.int64)
+        out = np.full((len(indices), self.DIM_N*self.DIM_Z), self.fill_value, dtype=np.float32)
+
+        offsets = self.directory['offset'][indices]
+        aux = self.directory['aux'][indices]
+        for index_offset in np.unique(aux):
+            rows = np.flatnonzero(aux == index_offset)
+            cells = self._index_set(int(index_offset))
+            values = np.stack([self._payload(int(offsets[row]), '<f4') for row in rows])
+            out[rows[:, None], cells[None, :]] = values
+
+        return out.reshape(len(indices), self.DIM_Z, self.DIM_N)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.densify([index])[0]
+        return self.densify(np.arange(len(self))[index])
+
+    def __array__(self, dtype=None, copy=None):
+        frames = self.densify(np.arange(len(self)))
+        return frames if dtype is None else frames.astype(dtype)
+
+
+class DatFile:
+    # zero-copy view of a .dat file (version 1 or 2): the frames are mapped with np.memmap as a structured record
+    # array (record header followed by DIM_Z x DIM_N float32), so opening is instant and only the pages of the frames
+    # that are actually used are read from disk. Sparse files are mapped as raw bytes and densified on read.
+    def __init__(self, path):
+        self.path = path
+        self.directory = None
+        with open(path, 'rb') as file:
+            header = read_header(file)
+            self.version = header['version']
+            self.DIM_N, self.DIM_Z = header['DIM_N'], header['DIM_Z']
+            self.origin_N, self.origin_Z = header['origin_N'], header['origin_Z']
+            self.metadata = header.get('metadata', {})
+            self.fill_value = self.metadata.get('fill_value', DEFAULT_FILL_VALUE)
+            self.sparse = bool(header.get('flags', 0) & FLAG_SPARSE)
+
+            if self.version == 1:
+                self.dtype = np.dtype([('timestep', '<i4'), ('data', '<f4', (self.DIM_Z, self.DIM_N))])
+                count = (os.path.getsize(path) - LEGACY_HEADER_SIZE) // self.dtype.itemsize
+            else:
+                self.dtype = np.dtype(RECORD_HEADER_DTYPE.descr + [('data', '<f4', (self.DIM_Z, self.DIM_N))])
+                self.directory = read_directory(file, header)
+                if self.directory is None:
+                    print("Warning: Frame directory of",path,"is damaged, recovering frames by scanning.")
+                    self.directory, end = scan_records(file, header)
+                count = len(self.directory)
+
+                # dense frames are written back to back, so the records can be mapped as one array:
+                if not self.sparse and count > 0 and self.directory['offset'][-1] != header['data_offset'] + (count-1)*self.dtype.itemsize:
+                    raise ValueError("Frames of "+path+" are not contiguous")
+
+        if self.sparse:
+            raw = np.memmap(path, dtype=np.uint8, mode='r')
+            self.frames = SparseFrames(raw, self.directory, self.DIM_N, self.DIM_Z, self.fill_value)
+            self.timesteps = self.directory['timestep']
+        else:
+            if count > 0:
+                records = np.memmap(path, dtype=self.dtype, mode='r', offset=header['data_offset'], shape=(count,))
+            else:
+                records = np.zeros(0, dtype=self.dtype) # np.memmap can't map zero bytes
+
+            # (T, Z, N) view of all grids and the timestep of every frame:
+            self.frames = records['data']
+            self.timesteps = records['timestep']
+
+        self._timestep_order = None
+
+    def __len__(self):
+        return len(self.timesteps)
+
+    def __getitem__(self, index):
+        # O(1) frame access, returns (timestep, grid)
+        return int(self.timesteps[index]), self.frames[index]
+
+    def read_frames(self, indices):
+        # dense (len(indices), DIM_Z, DIM_N) array of the given frames
+        if self.sparse:
+            return self.frames.densify(indices)
+        return np.asarray(self.frames[np.asarray(indices, dtype=np.int64)])
+
+    def read_cells(self, indices, Z, N):
+        # (len(indices), len(Z)) values of the cells (Z, N) (absolute coordinates) in the given frames, gathered with
+        # one fancy-index operation. Cells outside the grid are fill_value.
+        indices = np.asarray(indices, dtype=np.int64)
+        row = np.asarray(Z) - self.origin_Z
+        column = np.asarray(N) - self.origin_N
+        inside = (row >= 0) & (row < self.DIM_Z) & (column >= 0) & (column < self.DIM_N)
+
+        values = np.full((len(indices), len(row)), self.fill_value, dtype=np.float32)
+        if self.sparse:
+            # densified in blocks of frames, so memory stays bounded:
+            for start in range(0, len(indices), 256):
+                frames = self.frames.densify(indices[start:start+256])
+                values[start:start+256, inside] = frames[:, row[inside], column[inside]]
+        else:
+            values[:, inside] = self.frames[indices[:, None], row[inside][None, :], column[inside][None, :]]
+        return values
+
+    def frames_of(self, timesteps):
+        # frame indices of many timesteps at once (-1 where a timestep is missing): a sorted-array join,
+        # the first frame of a repeated timestep wins
+        timesteps = np.asarray(timesteps)
+        if len(self.timesteps) == 0:
+            return np.full(timesteps.shape, -1, dtype=np.int64)
+        if self._timestep_order is None:
+            self._timestep_order = np.argsort(self.timesteps, kind='stable')
+
+        ordered = self.timesteps[self._timestep_order]
+        pos = np.minimum(np.searchsorted(ordered, timesteps, side='left'), len(ordered)-1)
+        return np.where(ordered[pos] == timesteps, self._timestep_order[pos], -1)
+
+
+def union_box(*files):
+    # (origin_N, origin_Z, DIM_N, DIM_Z) of the smallest grid that covers the grids of all files
+    N_min = min(dat.origin_N for dat in files)
+    Z_min = min(dat.origin_Z for dat in files)
+    N_end = max(dat.origin_N + dat.DIM_N for dat in files)
+    Z_end = max(dat.origin_Z + dat.DIM_Z for dat in files)
+    return N_min, Z_min, N_end - N_min, Z_end - Z_min
+
+
+def place(grid, origin_N, origin_Z, box, fill_value=DEFAULT_FILL_VALUE):
+    # grid (first cell at origin_N, origin_Z) on the grid box = (origin_N, origin_Z, DIM_N, DIM_Z): cells outside
+    # the box are cut off, cells of the box without data are fill_value. A view if the grid already starts at the box.
+    # Stacks of grids (..., DIM_Z, DIM_N) are placed as a whole.
+    box_N, box_Z, DIM_N, DIM_Z = box
+    if (origin_N, origin_Z) == (box_N, box_Z) and grid.shape[-2] >= DIM_Z and grid.shape[-1] >= DIM_N:
+        return grid[..., :DIM_Z, :DIM_N]
+
+    placed = np.full(grid.shape[:-2] + (DIM_Z, DIM_N), fill_value, dtype=grid.dtype)
+    N_start, N_end = max(origin_N, box_N), min(origin_N + grid.shape[-1], box_N + DIM_N)
+    Z_start, Z_end = max(origin_Z, box_Z), min(origin_Z + grid.shape[-2], box_Z + DIM_Z)
+    if N_end > N_start and Z_end > Z_start:
+        placed[..., Z_start-box_Z:Z_end-box_Z, N_start-box_N:N_end-box_N] = grid[..., Z_start-origin_Z:Z_end-origin_Z, N_start-origin_N:N_end-origin_N]
+    return placed
+
+
+def iter_timesteps(path, frames=None):
+    # lazily yields (timestep, header, grid) like xtime.iter_timesteps, grids are views into the mapped file.
+    # frames: optional list of frame indices (e.g. from FrameTable.select), all frames if None.
+    # The header holds the values of the metadata sidecar if there is one.
+    table = frametable.FrameTable.load(path)
+    dat = DatFile(path)
+
+    if frames is None:
+        frames = range(len(dat))
+
+    for index in frames:
+        timestep, grid = dat[index]
+        if table is not None and index < len(table):
+            header = table.header(index)
+        else:
+            header = {'timestep': timestep}
+        yield timestep, header, grid
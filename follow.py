@@ -0,0 +1,269 @@
+import os
+import time
+import numpy as np
+
+import datfile
+import framerender
+import frametable
+import perfstats
+import plot2D
+import plot2D_to_binary
+import xtime
+
+# Live mode for running simulations: the XTime text files of a folder (or single files) are polled while PRISM is
+# still writing them. New 'timestep' blocks are appended to the .dat file of each run (time2D_bin/, like
+# plot2D_to_binary.py) and only their frames are rendered (same PNGs as plot2D.py).
+#
+# A block counts as complete once the next 'timestep' header has been written, so a block that is only partially
+# written is never parsed; it is picked up by a later poll. The last block of a run is taken when the file stopped
+# growing for --timeout seconds (the run is considered finished then). The .dat file is committed after every poll,
+# readers always see a consistent file. The metadata sidecar is rebuilt from all frames, so it is written at most
+# every METADATA_INTERVAL seconds (and when following stops). The grid has to be fixed before the data is known: an existing .dat file
+# keeps its grid (following resumes after its last frame), new ones use FOLLOW_GRID or --grid. Isotopes outside the
+# grid are dropped with a warning.
+#
+# If a file shrinks (the run was restarted), its .dat file is written again from the start.
+
+# (origin_N, origin_Z, DIM_N, DIM_Z) of new .dat files: N 0..199, Z 0..119
+FOLLOW_GRID = (0, 0, 200, 120)
+
+# seconds between two polls of the files
+POLL_INTERVAL = 0.5
+
+# seconds between two writes of the metadata sidecar
+METADATA_INTERVAL = 5.0
+
+
+class TimeSeriesFollower:
+    # follows one text file: converts and renders its new blocks on every poll()
+    def __init__(self, path, output_dir, path_output=None, grid=FOLLOW_GRID, backend='matplotlib', sparse=False, chunk_size=xtime.CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.name = os.path.basename(path)[:-4]
+        self.dat_path = os.path.join(output_dir, self.name+'.dat')
+        self.path_output = path_output
+        self.backend = backend
+        self.sparse = sparse
+        self.grid = grid
+        self.renderer = None
+        self.dropped = 0
+
+        # header values of all frames (metadata sidecar), offset of the first block that is not converted yet:
+        self.headers = []
+        self.offset = 0
+        self.size = 0
+        self.writer = None
+        self.metadata_time = 0.0
+        self.metadata_changed = True
+        if os.path.exists(self.dat_path):
+            self._resume()
+        if self.writer is None:
+            self._start()
+
+    def _start(self):
+        # new .dat file, everything is converted from the start of the text file
+        origin_N, origin_Z, DIM_N, DIM_Z = self.grid
+        metadata = {'source': os.path.basename(self.path), 'values': 'log10(abundance)', 'fill_value': xtime.FILL_VALUE}
+        self.writer = datfile.DatWriter(self.dat_path, DIM_N, DIM_Z, metadata, sparse=self.sparse, fill_value=xtime.FILL_VALUE, origin_N=origin_N, origin_Z=origin_Z)
+        self.headers = []
+        self.offset = 0
+        self.size = 0
+        self.metadata_changed = True
+
+    def _resume(self):
+        # continue an existing .dat file: its frames have to be the first blocks of the text file. Their header values
+        # are read from the text again, the sidecar may be behind the .dat file.
+        with open(self.dat_path, 'rb') as f:
+            header = datfile.read_header(f)
+        if header['version'] == 1:
+            print("Warning: Can't resume legacy (version 1) file",self.dat_path,"- converting again.")
+            return
+
+        timesteps = datfile.DatFile(self.dat_path).timesteps.tolist()
+        headers = []
+        offset = 0
+        while len(headers) < len(timesteps):
+            # the last block was converted as well if the run was finished:
+            blocks = xtime.read_new_blocks(self.path, offset, chunk_size=self.chunk_size) or xtime.read_new_blocks(self.path, offset, True, self.chunk_size)
+            if len(blocks) == 0:
+                break
+            for block_header, body, end in blocks[:len(timesteps) - len(headers)]:
+                headers.append(xtime.parse_header(block_header))
+                offset = end
+        if [fields['timestep'] for fields in headers] != timesteps:
+            print("Warning:",self.dat_path,"does not match",self.path,"- converting again.")
+            return
+
+        self.grid = (header['origin_N'], header['origin_Z'], header['DIM_N'], header['DIM_Z'])
+        self.writer = datfile.DatWriter(self.dat_path, header['DIM_N'], header['DIM_Z'], append=True, origin_N=header['origin_N'], origin_Z=header['origin_Z'])
+        self.headers = headers
+        self.offset = offset
+        print("Resuming",self.path,"after timestep",self.headers[-1]['timestep'] if self.headers else None,"        ")
+
+    def poll(self, final=False):
+        # convert and render the blocks completed since the last poll, returns the number of new frames. With final
+        # the last block of the file is taken as well (the writer finished). The file is read chunk by chunk until no
+        # complete block is left, so a large backlog (following a run that is already far in) is taken at once.
+        size = os.path.getsize(self.path)
+        if size < self.size:
+            print("Warning:",self.path,"was truncated, converting again.")
+            self.writer.close()
+            self._start()
+        if size == self.size and not final:
+            return 0
+        self.size = size
+
+        count = 0
+        while True:
+            frames = self._convert(final)
+            if frames == 0:
+                return count
+            count += frames
+
+    def _convert(self, final):
+        # convert and render the complete blocks of one chunk after self.offset, returns the number of frames
+        with perfstats.stage('parse'):
+            blocks = xtime.read_new_blocks(self.path, self.offset, final, self.chunk_size)
+        if len(blocks) == 0:
+            return 0
+
+        origin_N, origin_Z, DIM_N, DIM_Z = self.grid
+        grids = []
+        for header, body, end in blocks:
+            with perfstats.stage('parse'):
+                fields = xtime.parse_header(header)
+                Z, N, values = xtime.parse_columns(body)
+            with perfstats.stage('rasterize'):
+                grid = xtime.rasterize_cells(Z, N, values, DIM_N, DIM_Z, origin_N, origin_Z)
+            self._check_dropped(Z, N)
+            with perfstats.stage('write'):
+                self.writer.write_frame(fields['timestep'], grid)
+            self.headers.append(fields)
+            self.offset = end
+            grids.append((fields['timestep'], grid))
+
+        # make the new frames visible to readers of the .dat file:
+        with perfstats.stage('write'):
+            self.writer.commit()
+        self.metadata_changed = True
+        if time.time() - self.metadata_time >= METADATA_INTERVAL:
+            self._save_metadata()
+        perfstats.count('frames', len(grids))
+
+        if self.path_output is not None:
+            for timestep, grid in grids:
+                self._render(timestep, grid)
+        return len(grids)
+
+    def _check_dropped(self, Z, N):
+        origin_N, origin_Z, DIM_N, DIM_Z = self.grid
+        outside = np.count_nonzero((N < origin_N) | (N >= origin_N + DIM_N) | (Z < origin_Z) | (Z >= origin_Z + DIM_Z))
+        if outside > 0 and self.dropped == 0:
+            print("Warning: Isotopes of",self.path,"outside the grid (N",origin_N,"..",origin_N+DIM_N-1,", Z",origin_Z,"..",origin_Z+DIM_Z-1,") are dropped, see --grid.")
+        self.dropped += outside
+
+    def _render(self, timestep, grid):
+        # same frames as plot2D.py, the renderer is kept for the whole run
+        if self.renderer is None:
+            origin_N, origin_Z, DIM_N, DIM_Z = self.grid
+            A, Z = np.meshgrid(range(origin_N, origin_N+DIM_N), range(origin_Z, origin_Z+DIM_Z))
+            self.renderer = framerender.create_renderer(self.backend, A, Z, plot2D.VMIN, plot2D.VMAX, plot2D.CMAP, plot2D.DPI)
+        with perfstats.stage('render'):
+            self.renderer.render(grid, plot2D.frame_output_path(self.path_output, self.name, timestep))
+        perfstats.count_file('bytes_out', plot2D.frame_output_path(self.path_output, self.name, timestep))
+
+    def _save_metadata(self):
+        with perfstats.stage('metadata'):
+            frametable.FrameTable.from_headers(self.headers).save(self.dat_path)
+        self.metadata_time = time.time()
+        self.metadata_changed = False
+
+    def close(self):
+        self.writer.close()
+        if self.metadata_changed:
+            self._save_metadata()
+        if self.renderer is not None:
+            self.renderer.close()
+
+
+def time_series_files(paths):
+    # text files to follow: files as given, folders contribute their *Time*.txt files
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, file) for file in os.listdir(path) if file.endswith('.txt') and 'Time' in file)
+        else:
+            files.append(path)
+    return files
+
+
+def FollowTimeSeries(paths, path_output=None, grid=FOLLOW_GRID, backend='matplotlib', sparse=False, poll_interval=POLL_INTERVAL, timeout=None):
+    # follow the text files (and the *Time*.txt files of folders) in paths until nothing changed for timeout seconds
+    # (forever if timeout is None, stop with Ctrl+C). Frames are rendered to path_output (relative to the folder of
+    # every file, like plot2D.py) if it is given.
+    followers = {}
+    last_change = time.time()
+    try:
+        while True:
+            # files that appear later (new runs in a followed folder) are picked up as well:
+            for path in time_series_files(paths):
+                if path not in followers and os.path.exists(path):
+                    output_dir = os.path.join(os.path.dirname(path), plot2D_to_binary.path_time_series)
+                    frame_dir = None if path_output is None else os.path.join(os.path.dirname(path), path_output, '')
+                    for folder in [output_dir] + ([frame_dir] if frame_dir is not None else []):
+                        if not os.path.exists(folder):
+                            os.makedirs(folder)
+                    print("Following",path,"        ")
+                    followers[path] = TimeSeriesFollower(path, output_dir, frame_dir, grid, backend, sparse)
+
+            new = 0
+            for path, follower in followers.items():
+                frames = follower.poll()
+                if frames > 0:
+                    print("Following",path,": timestep",follower.headers[-1]['timestep'],"(",len(follower.headers),"frames)        ", end="\r", flush=True)
+                new += frames
+
+            if new > 0:
+                last_change = time.time()
+            elif timeout is not None and time.time() - last_change > timeout:
+                # the runs are finished, their last blocks are complete now:
+                for path, follower in followers.items():
+                    follower.poll(final=True)
+                break
+            else:
+                time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        print("\nStopped.")
+    finally:
+        for follower in followers.values():
+            follower.close()
+
+    for path, follower in followers.items():
+        print(path,":",len(follower.headers),"frames in",follower.dat_path,"        ")
+        if follower.dropped > 0:
+            print("Warning:",follower.dropped,"isotope values outside the grid were dropped.")
+
+
+def add_arguments(parser):
+    # command line options (this script and "prism.py follow")
+    parser.add_argument('paths', type=str, nargs='+', help='XTime text files or folders (their *Time*.txt files are followed).')
+    parser.add_argument('--output-path', type=str, default=None, help='Render the new frames to this folder (relative to the folder of every file, like plot2D.py).')
+    parser.add_argument('--backend', choices=framerender.BACKENDS, default='matplotlib', help='matplotlib figures or the fast raster output (no axes).')
+    parser.add_argument('--grid', type=int, nargs=4, metavar=('ORIGIN_N', 'ORIGIN_Z', 'DIM_N', 'DIM_Z'), default=list(FOLLOW_GRID), help='Grid of new .dat files (existing files keep theirs).')
+    parser.add_argument('--sparse', action='store_true', help='Store only the populated cells of every frame (new .dat files).')
+    parser.add_argument('--poll', type=float, default=POLL_INTERVAL, help='Seconds between two polls of the files.')
+    parser.add_argument('--timeout', type=float, default=None, help='Stop when no file changed for this many seconds (the last blocks are converted then). Default: follow until Ctrl+C.')
+    perfstats.add_arguments(parser)
+
+
+def main(args):
+    with perfstats.session('follow', args):
+        FollowTimeSeries(args.paths, args.output_path, tuple(args.grid), args.backend, args.sparse, args.poll, args.timeout)
+
+
+# main method, read files and options from command line arguments
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Follow the XTime files of running simulations: convert and render new timesteps as they are written.')
+    add_arguments(parser)
+    main(parser.parse_args())
@@ -0,0 +1,285 @@
+import struct
+import zlib
+import numpy as np
+
+# Renderers for many frames of the same shape, both have the same interface:
+#
+#   matplotlib (FrameRenderer): figure, mesh, colorbar and the static overlays (reference isotopes, shell closures)
+#              are created once; every frame only replaces the mesh values and the text before it is saved. The
+#              output is the same as building the plot from scratch for every frame.
+#   raster (RasterRenderer): no matplotlib per frame. Values are mapped through the colormap lookup table to uint8
+#              RGB, every cell becomes a RASTER_CELL x RASTER_CELL block, the pre-rasterized overlay (shell closures,
+#              isotope boxes) and the text are composited and the PNG is written directly. No axes, the color legend
+#              is a strip right of the chart labeled with vmin, center and vmax.
+#
+# Both can also hand out a frame as (height, width, 3) uint8 RGB image instead of writing a PNG (frame()), those images
+# are streamed into a video or GIF by write_frames() without any files in between.
+#
+# matplotlib is only imported when a renderer is created, importing this module (constants, write_frames) is cheap.
+
+BACKENDS = ('matplotlib', 'raster')
+
+# raster backend: pixels per cell, border around chart and legend, legend strip width, overlay color, text size
+RASTER_CELL = 6
+RASTER_MARGIN = 10
+RASTER_LEGEND = 20
+RASTER_OVERLAY_COLOR = (128, 128, 128)
+RASTER_FONT_SIZE = 9
+
+# frame rate of streamed videos and GIFs (same as make_anim.create_gif)
+VIDEO_FPS = 30
+
+
+class FrameRenderer:
+    def __init__(self, A, Z, vmin, vmax, cmap, dpi):
+        # A, Z: mesh grid (cell centers) of the frames
+        import matplotlib.pyplot as plt
+        self.dpi = dpi
+        self.shape = A.shape
+        self.figure = plt.figure(dpi=dpi)
+        self.axes = self.figure.gca()
+
+        self.mesh = self.axes.pcolormesh(A, Z, np.zeros(A.shape), vmin=vmin, vmax=vmax, cmap=cmap)
+
+        # add scale, set axis labels:
+        self.figure.colorbar(self.mesh)
+        self.axes.set_xlabel('N')
+        self.axes.set_ylabel('Z')
+
+        self.text = None
+
+    def add_isotope_boxes(self, list_of_isotopes):
+        # draw a rectangle around the reference isotopes, isotope = (Z, N, name, abundance)
+        import matplotlib.pyplot as plt
+        for isotope in list_of_isotopes:
+            isoZ = isotope[0]
+            isoN = isotope[1]
+            self.axes.add_patch(plt.Rectangle((isoN-0.5, isoZ-0.5), 1, 1, fill=False, facecolor='none', edgecolor='gray', lw=0.15))
+
+    def add_shell_closures(self, magic_numbers_protons, magic_numbers_neutrons):
+        # draw lines at shell closures
+        for magic_number in magic_numbers_protons:
+            self.axes.axhline(y=magic_number-0.5, color='gray', lw=0.15)
+        for magic_number in magic_numbers_neutrons:
+            self.axes.axvline(x=magic_number-0.5, color='gray', lw=0.15)
+
+    def add_text(self):
+        # text in the top left corner, set for every frame by render()
+        self.text = self.axes.text(0.01, 0.99, '', horizontalalignment='left', verticalalignment='top', transform=self.axes.transAxes)
+
+    def _update(self, grid, text):
+        self.mesh.set_array(np.asarray(grid))
+        if text is not None:
+            self.text.set_text(text)
+
+    def frame(self, grid, text=None):
+        # (height, width, 3) uint8 RGB image of a frame, same pixels as the saved PNG (a view of the canvas buffer,
+        # overwritten by the next frame)
+        self._update(grid, text)
+        self.figure.canvas.draw()
+        return np.asarray(self.figure.canvas.buffer_rgba())[:, :, :3]
+
+    def render(self, grid, path, text=None):
+        # save one frame (grid with the shape of the mesh) to path
+        self._update(grid, text)
+        self.figure.savefig(path, dpi=self.dpi)
+
+    def close(self):
+        import matplotlib.pyplot as plt
+        plt.close(self.figure)
+
+
+def write_png(path, rgb, level=1):
+    # write an (height, width, 3) uint8 array as 8 bit RGB PNG (filter type 0 on every row, zlib compressed)
+    height, width = rgb.shape[:2]
+    raw = np.empty((height, width*3 + 1), dtype=np.uint8)
+    raw[:, 0] = 0
+    raw[:, 1:] = rgb.reshape(height, width*3)
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(raw.tobytes(), level)))
+        f.write(chunk(b'IEND', b''))
+
+
+class RasterRenderer:
+    def __init__(self, A, Z, vmin, vmax, cmap, cell=RASTER_CELL):
+        # A, Z: mesh grid (cell centers) of the frames, only shape and first cell are used
+        self.shape = A.shape
+        self.origin_N, self.origin_Z = int(A[0, 0]), int(Z[0, 0])
+        self.vmin, self.vmax = vmin, vmax
+        self.cell = cell
+
+        # colormap lookup table (uint8 RGB), same entries as matplotlib uses:
+        import matplotlib
+        colormap = matplotlib.colormaps[cmap]
+        self.lut = (colormap(np.arange(colormap.N))[:, :3]*255 + 0.5).astype(np.uint8)
+
+        DIM_Z, DIM_N = self.shape
+        self.height, self.width = DIM_Z*cell, DIM_N*cell
+
+        # font for text and legend labels:
+        from matplotlib import font_manager, ft2font
+        self.font = ft2font.FT2Font(font_manager.findfont(font_manager.FontProperties()))
+        self.font.set_size(RASTER_FONT_SIZE, 100)
+
+        # canvas: chart, then legend strip and labels (both static), white background
+        legend_x = RASTER_MARGIN + self.width + RASTER_MARGIN
+        label_x = legend_x + RASTER_LEGEND + 4
+        labels = [self._text_bitmap(('%g' % value)) for value in (vmax, (vmin + vmax)/2, vmin)]
+        self.canvas = np.full((self.height + 2*RASTER_MARGIN, label_x + max(label.shape[1] for label in labels) + RASTER_MARGIN, 3), 255, dtype=np.uint8)
+
+        rows = (np.arange(self.height)[::-1] + 0.5) / self.height
+        self.canvas[RASTER_MARGIN:RASTER_MARGIN+self.height, legend_x:legend_x+RASTER_LEGEND] = self.lut[self._lut_index(vmin + rows*(vmax - vmin))][:, None, :]
+        for label, y in zip(labels, (RASTER_MARGIN, RASTER_MARGIN + self.height//2, RASTER_MARGIN + self.height)):
+            self._draw_bitmap(label, label_x, min(max(y - label.shape[0]//2, 0), self.canvas.shape[0] - label.shape[0]))
+
+        # (DIM_Z, cell, DIM_N, cell, 3) view of the chart, every cell is a block of pixels:
+        self.chart = self.canvas[RASTER_MARGIN:RASTER_MARGIN+self.height, RASTER_MARGIN:RASTER_MARGIN+self.width].reshape(DIM_Z, cell, DIM_N, cell, 3)
+
+        # overlay pixels (flat indices into the canvas), drawn on top of every frame:
+        self.overlay = np.zeros(self.canvas.shape[:2], dtype=bool)
+        self.overlay_index = None
+        self.text = False
+
+    def _lut_index(self, values):
+        # lookup table entry of every value (vmin..vmax, clipped like matplotlib's Normalize)
+        index = (np.asarray(values, dtype=np.float32) - self.vmin) * (len(self.lut) / (self.vmax - self.vmin))
+        np.clip(index, 0, len(self.lut) - 1, out=index)
+        return index.astype(np.intp)
+
+    def _text_bitmap(self, line):
+        # grayscale (alpha) bitmap of a line of text
+        self.font.clear()
+        self.font.set_text(line, 0.0)
+        self.font.draw_glyphs_to_bitmap()
+        return np.asarray(self.font.get_image())
+
+    def _draw_bitmap(self, bitmap, x, y, right=None):
+        # draw black text (alpha bitmap) at x, y, clipped at the canvas (or at right)
+        right = self.canvas.shape[1] if right is None else right
+        height = min(bitmap.shape[0], self.canvas.shape[0] - y)
+        width = min(bitmap.shape[1], right - x)
+        if height <= 0 or width <= 0:
+            return
+        alpha = bitmap[:height, :width, None].astype(np.uint16)
+        region = self.canvas[y:y+height, x:x+width]
+        region[...] = (region * (255 - alpha) // 255).astype(np.uint8)
+
+    def _chart_x(self, N):
+        # canvas column of the left edge of cell N
+        return RASTER_MARGIN + (N - self.origin_N)*self.cell
+
+    def _chart_y(self, Z):
+        # canvas row of the lower edge of cell Z (Z grows upwards)
+        return RASTER_MARGIN + (self.shape[0] - (Z - self.origin_Z))*self.cell
+
+    def add_isotope_boxes(self, list_of_isotopes):
+        # outline of the reference isotope cells, isotope = (Z, N, name, abundance)
+        for isotope in list_of_isotopes:
+            x, y = self._chart_x(isotope[1]), self._chart_y(isotope[0]) - self.cell
+            if RASTER_MARGIN <= x and x + self.cell <= RASTER_MARGIN + self.width and RASTER_MARGIN <= y and y + self.cell <= RASTER_MARGIN + self.height:
+                self.overlay[y, x:x+self.cell+1] = True
+                self.overlay[y+self.cell, x:x+self.cell+1] = True
+                self.overlay[y:y+self.cell+1, x] = True
+                self.overlay[y:y+self.cell+1, x+self.cell] = True
+        self.overlay_index = None
+
+    def add_shell_closures(self, magic_numbers_protons, magic_numbers_neutrons):
+        # lines between the cells below and above the shell closures
+        for magic_number in magic_numbers_protons:
+            y = self._chart_y(magic_number)
+            if RASTER_MARGIN <= y < RASTER_MARGIN + self.height:
+                self.overlay[y, RASTER_MARGIN:RASTER_MARGIN+self.width] = True
+        for magic_number in magic_numbers_neutrons:
+            x = self._chart_x(magic_number)
+            if RASTER_MARGIN <= x < RASTER_MARGIN + self.width:
+                self.overlay[RASTER_MARGIN:RASTER_MARGIN+self.height, x] = True
+        self.overlay_index = None
+
+    def add_text(self):
+        # text in the top left corner of the chart, set for every frame by render()
+        self.text = True
+
+    def frame(self, grid, text=None):
+        # (height, width, 3) uint8 RGB image of a frame (the internal canvas, overwritten by the next frame)
+        self.chart[...] = self.lut[self._lut_index(grid)[::-1]][:, None, :, None, :]
+
+        if self.overlay_index is None:
+            self.overlay_index = np.flatnonzero(self.overlay)
+        self.canvas.reshape(-1, 3)[self.overlay_index] = RASTER_OVERLAY_COLOR
+
+        if self.text and text is not None:
+            y = RASTER_MARGIN + 2
+            for line in text.split('\n'):
+                bitmap = self._text_bitmap(line)
+                if y + bitmap.shape[0] > RASTER_MARGIN + self.height:
+                    break
+                # black on white, so the text stays readable on any color:
+                width = min(bitmap.shape[1], self.width - 2)
+                self.canvas[y:y+bitmap.shape[0], RASTER_MARGIN+2:RASTER_MARGIN+2+width] = (255 - bitmap[:, :width])[:, :, None]
+                y += bitmap.shape[0] + 2
+        return self.canvas
+
+    def render(self, grid, path, text=None):
+        # save one frame (grid with the shape of the mesh) to path
+        write_png(path, self.frame(grid, text))
+
+    def close(self):
+        pass
+
+
+def create_renderer(backend, A, Z, vmin, vmax, cmap, dpi):
+    # renderer of the given backend (see BACKENDS), dpi is only used by matplotlib
+    if backend == 'raster':
+        return RasterRenderer(A, Z, vmin, vmax, cmap)
+    return FrameRenderer(A, Z, vmin, vmax, cmap, dpi)
+
+
+def write_frames(images, video_path=None, fps=VIDEO_FPS):
+    # consume the images iterator (RGB images or None, see frame()): streamed into the video or GIF at video_path
+    # (make_anim.write_animation), or just run through if there is no video
+    if video_path is None:
+        for image in images:
+            pass
+        return
+
+    import make_anim
+    make_anim.write_animation(images, video_path, fps)
+
+
+def frame_chunks(count, jobs, size=16):
+    # (start, end) ranges that split count frames into chunks for jobs worker processes: small enough to balance the
+    # load (about 4 chunks per worker), at most size frames each
+    size = max(1, min(size, -(-count // (4*jobs))))
+    return [(start, min(start + size, count)) for start in range(0, count, size)]
+
+
+def render_pool(function, tasks, jobs):
+    # run function(*task) for every task in a pool of jobs worker processes, results are yielded in task order.
+    # Only a window of 2*jobs tasks is in flight at a time.
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.submit(function, *task))
+            if len(pending) >= 2*jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def progress_string(done, total, start_time):
+    # "(elapsed: 12.0s, remaining: 30.0s)", the remaining time is estimated from the frames done so far
+    import time
+    elapsed = time.time() - start_time
+    text = "(elapsed: "+str(round(elapsed, 0))+"s"
+    if done > 0:
+        text += ", remaining: "+str(round(elapsed*(total - done)/done, 0))+"s"
+    return text+")"
@@ -0,0 +1,141 @@
+import os
+import numpy as np
+
+# Per-frame metadata of a converted time series, taken from the 'timestep' header lines:
+# timestep      3   time(s)  0.184731E-01   temperature(GK) 0.100000E+02   density(g/cm^3) 0.531701E+08   radius(arb.units) 0.100000E+09
+#
+# The table is stored next to the .dat file (XTime.dat -> XTime.meta.npz) with one array per column. Row i belongs to
+# frame i of the .dat file. For every column the sorting permutation is stored as well, so range and nearest value
+# lookups are binary searches and never need to rescan the text file. The byte-offset index of the text files
+# (xtime.BlockIndex) embeds the same table.
+
+COLUMNS = ('timestep', 'time', 'temperature', 'density', 'radius')
+
+
+def sidecar_path(dat_path):
+    return os.path.splitext(dat_path)[0]+'.meta.npz'
+
+
+class FrameTable:
+    def __init__(self, columns, orders=None):
+        self.columns = columns
+        self.orders = orders if orders is not None else {}
+
+        # sorting permutation of every column (stored with the table, only computed for new tables):
+        for name, values in self.columns.items():
+            if name not in self.orders:
+                self.orders[name] = np.argsort(values, kind='stable').astype(np.int32)
+
+    @classmethod
+    def from_headers(cls, headers):
+        # build table from a list of header dicts (see xtime.parse_header), missing fields are NaN
+        columns = {'timestep': np.array([header['timestep'] for header in headers], dtype=np.int32)}
+        for name in COLUMNS[1:]:
+            columns[name] = np.array([header.get(name, np.nan) for header in headers], dtype=np.float64)
+        return cls(columns)
+
+    @classmethod
+    def load(cls, dat_path):
+        # returns None if there is no sidecar for this .dat file
+        path = sidecar_path(dat_path)
+        if not os.path.exists(path):
+            return None
+
+        with np.load(path) as archive:
+            return cls.from_arrays(archive)
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        # inverse of to_arrays(), arrays may contain other entries as well
+        columns = {name: arrays[name] for name in COLUMNS if name in arrays}
+        orders = {name: arrays['order_'+name] for name in columns if 'order_'+name in arrays}
+        return cls(columns, orders)
+
+    def to_arrays(self):
+        # flat dict of arrays, as stored in the .npz files
+        arrays = dict(self.columns)
+        for name, order in self.orders.items():
+            arrays['order_'+name] = order
+        return arrays
+
+    def save(self, dat_path):
+        # np.savez appends .npz if missing, so write via file handle:
+        with open(sidecar_path(dat_path), 'wb') as f:
+            np.savez(f, **self.to_arrays())
+
+    def __len__(self):
+        return len(self.columns['timestep'])
+
+    def header(self, frame):
+        # header dict of a frame, same keys as xtime.parse_header
+        fields = {'timestep': int(self.columns['timestep'][frame])}
+        for name in COLUMNS[1:]:
+            if name in self.columns:
+                fields[name] = float(self.columns[name][frame])
+        return fields
+
+    def nearest(self, name, value):
+        # frame whose column value is closest to value, e.g. nearest('time', 1.2)
+        order = self.orders[name]
+        values = self.columns[name][order]
+        pos = np.searchsorted(values, value)
+
+        # closest of the two neighbours:
+        candidates = [p for p in (pos-1, pos) if 0 <= p < len(values)]
+        best = min(candidates, key=lambda p: abs(values[p] - value))
+        return int(order[best])
+
+    def bracket(self, name, values):
+        # frames enclosing every value (vectorized): (lower, upper, weight) with
+        # value = (1-weight)*column[lower] + weight*column[upper], lower = upper = -1 outside the range of the column
+        order = self.orders[name]
+        column = self.columns[name][order]
+
+        # NaN (missing values) are sorted to the end:
+        count = np.count_nonzero(~np.isnan(column))
+        order, column = order[:count], column[:count]
+
+        values = np.asarray(values, dtype=np.float64)
+        if count == 0:
+            missing = np.full(values.shape, -1, dtype=np.int64)
+            return missing, missing, np.zeros(values.shape)
+
+        pos = np.searchsorted(column, values, side='left')
+        upper = np.minimum(pos, count-1)
+        lower = np.maximum(pos-1, 0)
+        span = column[upper] - column[lower]
+        weight = np.where(span > 0, (values - column[lower]) / np.where(span > 0, span, 1), 0.0)
+
+        inside = (values >= column[0]) & (values <= column[-1])
+        return np.where(inside, order[lower], -1), np.where(inside, order[upper], -1), np.where(inside, weight, 0.0)
+
+    def select(self, name, low=None, high=None):
+        # sorted frame indices with low <= value <= high (either bound may be None), e.g. select('temperature', high=3)
+        order = self.orders[name]
+        values = self.columns[name][order]
+        start = 0 if low is None else np.searchsorted(values, low, side='left')
+        end = len(values) if high is None else np.searchsorted(values, high, side='right')
+        return np.sort(order[start:end])
+
+    def select_ranges(self, ranges):
+        # intersection of select() over a dict {name: (low, high)}, all frames if ranges is empty
+        frames = np.arange(len(self))
+        for name, (low, high) in ranges.items():
+            frames = np.intersect1d(frames, self.select(name, low, high), assume_unique=True)
+        return frames
+
+
+def add_range_arguments(parser):
+    # command line options to select frames by header values
+    for name in COLUMNS:
+        parser.add_argument('--'+name+'-range', dest=name+'_range', type=float, nargs=2, metavar=('LOW', 'HIGH'), default=None, help='only use frames with LOW <= '+name+' <= HIGH')
+
+
+def ranges_from_args(args):
+    # {name: (low, high)} of all range options that were given
+    ranges = {}
+    for name in COLUMNS:
+        value = getattr(args, name+'_range', None)
+        if value is not None:
+            ranges[name] = (value[0], value[1])
+    return ranges
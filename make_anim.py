@@ -1,86 +1,333 @@
 import os
-import imageio.v3 as iio
-import cv2
+import struct
+import numpy as np
 
-def create_gif(input_folder, output_path, delay, max_frames):
-    # Get all .png files from the input folder
+import perfstats
+
+# imageio and cv2 are imported by the functions that use them, importing this module (e.g. for the animation writers
+# of framerender.write_frames) does not load them.
+
+# frames decoded ahead of the writer by read_frames
+PREFETCH = 8
+
+# adaptive frame selection: every CHANGE_STRIDE-th pixel or grid cell (in both directions) is compared
+CHANGE_STRIDE = 4
+
+
+def prefetch(function, items, depth=PREFETCH):
+    # function(item) for every item, evaluated by a thread pool up to depth items ahead of the consumer, results are
+    # yielded in order. At most depth + 1 results are held at a time.
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=max(1, min(depth, os.cpu_count() or 1))) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(function, item))
+            if len(pending) > depth:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def read_png(file_path):
+    # RGB image of a png file
+    import imageio.v3 as iio
+    return iio.imread(file_path)[:, :, :3]
+
+
+def png_paths(input_folder, max_frames):
+    # paths of the .png files in the input folder, sorted by filename, at most max_frames
     png_files = [f for f in os.listdir(input_folder) if f.endswith('.png')]
-    
-    # Sort the files by their filename
     png_files.sort()
-    
-    # Create a list to store the images
-    images = []
+    return [os.path.join(input_folder, png_file) for png_file in png_files[:max_frames]]
 
-    # Read each file and append it to the images list
-    frame_count = 0
-    for png_file in png_files:
-        file_path = os.path.join(input_folder, png_file)
 
+def read_files(file_paths, depth=PREFETCH):
+    # RGB images of the png files. The next depth files are decoded by a thread pool while the current frame is encoded
+    # 'decode' is the time spent waiting for the decoded frames:
+    for file_path, image in zip(file_paths, perfstats.timed('decode', prefetch(read_png, file_paths, depth))):
         print("Reading file:",file_path,"        ", end="\r", flush=True)
-        images.append(iio.imread(file_path))
+        perfstats.count_file('bytes_in', file_path)
+        yield image
 
-        frame_count += 1
-        if frame_count >= max_frames:
-            break
-    
-    print("Creating ",output_path,"        ", end="\r", flush=True)
-    # Create a gif/webp from the images with the specified delay
-    iio.imwrite(output_path, images, fps=30)
 
-    print("Operation completed.        ")
+def read_frames(input_folder, max_frames, depth=PREFETCH):
+    # RGB images of the .png files in the input folder (sorted by filename, at most max_frames)
+    return read_files(png_paths(input_folder, max_frames), depth)
 
 
+def frame_changes(file_paths, depth=PREFETCH):
+    # change of every frame against the previous one: mean abs difference of the colors (0..255) on every
+    # CHANGE_STRIDE-th pixel, 0 for the first frame and 255 if the size changes
+    changes = np.zeros(len(file_paths))
+    previous = None
+    for i, image in enumerate(perfstats.timed('decode', prefetch(read_png, file_paths, depth))):
+        print("Measuring change:",file_paths[i],"        ", end="\r", flush=True)
+        with perfstats.stage('select'):
+            sample = image[::CHANGE_STRIDE, ::CHANGE_STRIDE].astype(np.int16)
+            if previous is not None:
+                changes[i] = np.abs(sample - previous).mean() if sample.shape == previous.shape else 255
+            previous = sample
+    return changes
 
-def create_video(input_folder, output_path, delay, max_frames):
-    # Get all .png files from the input folder
-    png_files = [f for f in os.listdir(input_folder) if f.endswith('.png')]
-    
-    # Sort the files by their filename
-    png_files.sort()
-    
-    frame_count = 0
-    # Calculate FPS from the delay
-    fps = int(1 / delay)
 
-    # Read the first file to get the dimensions
-    first_image = cv2.imread(os.path.join(input_folder, png_files[0]))
-    h, w, layers = first_image.shape
-    size = (w, h)
+def grid_changes(file_paths, dat_path):
+    # the same change metric from the grids of the .dat file the frames were rendered from, no PNG is decoded: frames
+    # are matched by the timestep in their names (name_<timestep>.png, see plot2D.py), every CHANGE_STRIDE-th cell is
+    # compared and the mean abs difference is scaled to 0..255 over the color range (plot2D.VMIN..VMAX). None if a
+    # frame has no grid in the file
+    import datfile
+    import plot2D
+    try:
+        timesteps = [int(os.path.basename(file_path)[:-4].rsplit('_', 1)[-1]) for file_path in file_paths]
+    except ValueError:
+        return None
+    dat = datfile.DatFile(dat_path)
+    frames = dat.frames_of(timesteps)
+    if np.any(frames < 0):
+        return None
+
+    changes = np.zeros(len(file_paths))
+    previous = None
+    for i, frame in enumerate(frames):
+        with perfstats.stage('select'):
+            sample = np.clip(dat.read_frames([frame])[0, ::CHANGE_STRIDE, ::CHANGE_STRIDE], plot2D.VMIN, plot2D.VMAX)
+            if previous is not None:
+                changes[i] = 255 * np.abs(sample - previous).mean() / (plot2D.VMAX - plot2D.VMIN)
+            previous = sample
+    return changes
+
+
+def select_frames(changes, threshold=None, budget=None):
+    # frames to keep (indices) and the number of input frames every kept frame stands for (itself and the skipped
+    # frames after it). A frame is kept whenever the change accumulated since the first frame passes another multiple
+    # of threshold, so quiet phases are thinned out and fast ones are kept. A budget (maximum number of frames) sets
+    # the threshold to the total change divided by budget - 1 (the larger of both is used). The first frame is always
+    # kept
+    if threshold is None:
+        threshold = 0.0
+    if budget is not None and budget < len(changes):
+        total = changes[1:].sum()
+        threshold = max(threshold, total / (budget - 1) if budget > 1 and total > 0 else np.inf)
+
+    if threshold <= 0:
+        keep = np.arange(len(changes))
+    else:
+        # (small tolerance, so the last multiple is reached despite rounding)
+        level = np.floor(np.cumsum(changes) / threshold + 1e-9)
+        keep = np.flatnonzero(np.diff(level, prepend=-1) > 0)
+    return keep, np.diff(np.append(keep, len(changes)))
+
+
+class GifWriter:
+    # streaming GIF writer: every frame is reduced to an adaptive palette of up to 256 colors and LZW encoded by Pillow
+    # (as a single frame GIF), its palette and image data are appended to the file as soon as the frame arrives. Only
+    # one frame is in memory at a time.
+    def __init__(self, path, fps, loop=0):
+        self.file = open(path, 'wb')
+        self.fps = fps
+        self.loop = loop
+        self.size = None
+
+    def write(self, image, duration=1):
+        # duration: display time in frames (1/fps)
+        from io import BytesIO
+        from PIL import Image
+
+        encoded = BytesIO()
+        Image.fromarray(np.ascontiguousarray(image[:, :, :3])).convert('P', palette=Image.Palette.ADAPTIVE).save(encoded, 'GIF')
+        palette, interlace, data = self._split(encoded.getvalue())
+
+        h, w = image.shape[:2]
+        if self.size is None:
+            # header, logical screen (no global palette) and loop count (NETSCAPE2.0 extension):
+            self.size = (w, h)
+            self.file.write(b'GIF89a' + struct.pack('<HHBBB', w, h, 0x70, 0, 0))
+            self.file.write(b'!\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', self.loop) + b'\x00')
+        elif self.size != (w, h):
+            raise ValueError('GIF frames need the same size: '+str(self.size)+' != '+str((w, h)))
+
+        # graphic control extension (delay), image descriptor with local palette, LZW data:
+        bits = (len(palette) // 3).bit_length() - 2
+        # delay in 1/100 s:
+        delay = max(1, round(100 * duration / self.fps))
+        self.file.write(b'!\xf9\x04' + struct.pack('<BHBB', 0, delay, 0, 0))
+        self.file.write(b',' + struct.pack('<HHHHB', 0, 0, w, h, 0x80 | interlace | bits))
+        self.file.write(palette)
+        self.file.write(data)
+
+    @staticmethod
+    def _split(gif):
+        # (palette, interlace flag, LZW data incl. code size and block terminator) of a single frame GIF
+        packed = gif[10]
+        position = 13
+        palette = b''
+        if packed & 0x80:
+            palette = gif[position:position + 3*2**((packed & 7) + 1)]
+            position += len(palette)
+
+        # skip extensions up to the image descriptor:
+        while gif[position] == 0x21:
+            position += 2
+            while gif[position]:
+                position += gif[position] + 1
+            position += 1
+
+        packed = gif[position + 9]
+        interlace = packed & 0x40
+        position += 10
+        if packed & 0x80:
+            palette = gif[position:position + 3*2**((packed & 7) + 1)]
+            position += len(palette)
+
+        # everything up to the trailer (';'):
+        return palette, interlace, gif[position:-1]
 
-    # Initialize VideoWriter (using *'XVID' as the codec)
-    out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    def close(self):
+        self.file.write(b';')
+        self.file.close()
 
-    for png_file in png_files:
-        file_path = os.path.join(input_folder, png_file)
 
-        print("Reading file:", file_path, "        ", end="\r", flush=True)
-        
-        img = cv2.imread(file_path)
-        out.write(img)
+def write_gif(frames, output_path, fps, durations=None):
+    # Create a gif/webp from the RGB images of the frames iterator, returns the number of frames. GIFs are written one
+    # frame at a time (GifWriter), webp through imageio, which needs all frames at once. durations: display time of
+    # every frame in 1/fps (see select_frames), all 1 if not given
+    if not output_path.lower().endswith('.gif'):
+        # images are copied, renderers reuse their image buffer for the next frame:
+        images = [np.array(image[:, :, :3]) for image in frames]
+        if not images:
+            return 0
 
+        print("Creating ",output_path,"        ", end="\r", flush=True)
+        import imageio.v3 as iio
+        with perfstats.stage('encode'):
+            if durations is None:
+                iio.imwrite(output_path, images, fps=fps)
+            else:
+                iio.imwrite(output_path, images, duration=[1000*duration/fps for duration in durations[:len(images)]])
+        perfstats.count('frames_encoded', len(images))
+        perfstats.count_file('bytes_out', output_path)
+        return len(images)
+
+    out = None
+    frame_count = 0
+    for image in frames:
+        with perfstats.stage('encode'):
+            if out is None:
+                out = GifWriter(output_path, fps)
+            out.write(image, 1 if durations is None else durations[frame_count])
+        frame_count += 1
+
+    if out is not None:
+        out.close()
+        perfstats.count('frames_encoded', frame_count)
+        perfstats.count_file('bytes_out', output_path)
+    return frame_count
+
+
+def write_video(frames, output_path, fps, durations=None):
+    # Write the RGB images of the frames iterator to a video, one frame at a time. The size is taken from the first
+    # frame. Returns the number of frames. With durations (see write_gif) frames are repeated, the frame rate of a
+    # video is fixed
+    import cv2
+    out = None
+    frame_count = 0
+    for image in frames:
+        if out is None:
+            h, w = image.shape[:2]
+            # Initialize VideoWriter (using *'XVID' as the codec)
+            out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (w, h))
+
+        # OpenCV expects BGR:
+        with perfstats.stage('encode'):
+            bgr = cv2.cvtColor(np.ascontiguousarray(image[:, :, :3]), cv2.COLOR_RGB2BGR)
+            for repeat in range(1 if durations is None else durations[frame_count]):
+                out.write(bgr)
         frame_count += 1
-        if frame_count >= max_frames:
-            break
-    
-    out.release()
+
+    if out is not None:
+        with perfstats.stage('encode'):
+            out.release()
+        perfstats.count('frames_encoded', frame_count)
+        perfstats.count_file('bytes_out', output_path)
+    return frame_count
+
+
+def write_animation(frames, output_path, fps, durations=None):
+    # gif/webp or video, depending on the extension of output_path
+    if output_path.lower().endswith(('.gif', '.webp')):
+        return write_gif(frames, output_path, fps, durations)
+    return write_video(frames, output_path, fps, durations)
+
+
+def selected_files(input_folder, max_frames, depth=PREFETCH, threshold=None, budget=None, change_source=None):
+    # png files to encode and their durations (see select_frames), all files and None without threshold and budget.
+    # change_source: .dat file the frames were rendered from, the change is measured on its grids (see grid_changes)
+    file_paths = png_paths(input_folder, max_frames)
+    if threshold is None and budget is None:
+        return file_paths, None
+
+    # first pass: change between consecutive frames, only the kept frames are decoded (again)
+    changes = None
+    if change_source is not None:
+        changes = grid_changes(file_paths, change_source)
+        if changes is None:
+            print("Warning: Not all frames of",input_folder,"have a grid in",change_source,"- measuring the change on the png files.")
+    if changes is None:
+        changes = frame_changes(file_paths, depth)
+    keep, durations = select_frames(changes, threshold, budget)
+    print("Keeping",len(keep),"of",len(file_paths),"frames.        ")
+    return [file_paths[i] for i in keep], durations
+
+
+def create_gif(input_folder, output_path, delay, max_frames, depth=PREFETCH, threshold=None, budget=None, keep_timing=False, change_source=None):
+    # threshold, budget: adaptive frame selection (see select_frames, change_source: see selected_files), keep_timing:
+    # skipped frames extend the display time of the kept frame before them
+    # Calculate FPS from the delay (not rounded, GIF delays are in 1/100 s)
+    fps = 1 / delay
+
+    file_paths, durations = selected_files(input_folder, max_frames, depth, threshold, budget, change_source)
+    write_gif(read_files(file_paths, depth), output_path, fps, durations if keep_timing else None)
+
     print("Operation completed.        ")
 
 
-# main method, read input_folder, output_path and delay from command line arguments
-if __name__ == '__main__':
-    import sys
-    if not (len(sys.argv) in [4, 5]):
-        print('Usage: python make_gif.py <input_folder> <output_path> <delay> (<max_frames>)')
-        sys.exit(1)
+def create_video(input_folder, output_path, delay, max_frames, depth=PREFETCH, threshold=None, budget=None, keep_timing=False, change_source=None):
+    # Calculate FPS from the delay
+    fps = int(1 / delay)
 
-    # read arguments:
-    import argparse
-    parser = argparse.ArgumentParser(description='Create a gif from a folder of png files.')
+    file_paths, durations = selected_files(input_folder, max_frames, depth, threshold, budget, change_source)
+    write_video(read_files(file_paths, depth), output_path, fps, durations if keep_timing else None)
+
+    print("Operation completed.        ")
+
+
+def add_arguments(parser):
+    # command line options (this script and "prism.py animate")
     parser.add_argument('input_folder', type=str, help='The folder containing the png files.')
     parser.add_argument('output_path', type=str, help='The path to the output gif file.')
     parser.add_argument('delay', type=float, help='The delay between frames in the gif (in seconds).')
     parser.add_argument('max_frames', type=int, help='The maximum number of frames to include in the gif.')
-    args = parser.parse_args()
+    parser.add_argument('--prefetch', type=int, default=PREFETCH, help='Number of png files decoded ahead of the encoder.')
+    parser.add_argument('--change-threshold', type=float, default=None, help='Skip frames until the accumulated change (mean abs color difference, 0..255) reaches this value.')
+    parser.add_argument('--frame-budget', type=int, default=None, help='Keep at most this many frames, spread by change.')
+    parser.add_argument('--change-source', type=str, default=None, help='.dat file the frames were rendered from (name_<timestep>.png): the change is measured on its grids instead of decoding every png file.')
+    parser.add_argument('--keep-timing', action='store_true', help='Show kept frames longer instead of dropping the time of skipped frames.')
+    perfstats.add_arguments(parser)
+
+
+def main(args):
+    with perfstats.session('make_anim', args):
+        if args.output_path.lower().endswith(('.gif', '.webp')):
+            create_gif(args.input_folder, args.output_path, args.delay, args.max_frames, args.prefetch, args.change_threshold, args.frame_budget, args.keep_timing, args.change_source)
+        else:
+            create_video(args.input_folder, args.output_path, args.delay, args.max_frames, args.prefetch, args.change_threshold, args.frame_budget, args.keep_timing, args.change_source)
 
-    create_video(args.input_folder, args.output_path, args.delay, args.max_frames)
+
+# main method, read input_folder, output_path, delay and max_frames from command line arguments
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Create a gif or video from a folder of png files.')
+    add_arguments(parser)
+    main(parser.parse_args())
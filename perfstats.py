@@ -0,0 +1,123 @@
+import contextlib
+import json
+import os
+import sys
+import time
+
+# Lightweight instrumentation shared by all scripts.
+#
+# Stages (parse, rasterize, render, encode, ...) accumulate wall time, CPU time and the number of calls, counters
+# accumulate frames and bytes. Both are kept per process: with worker pools the stages cover the main process (time
+# spent waiting for the workers included), the CPU time of the workers is reported as children_cpu.
+# session() wraps the main function of a script: it writes a JSON summary (--stats) and optionally runs everything
+# in cProfile (--profile).
+
+stages = {}
+counters = {}
+
+
+@contextlib.contextmanager
+def stage(name):
+    # time the enclosed block as stage name
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield
+    finally:
+        entry = stages.setdefault(name, {'wall': 0.0, 'cpu': 0.0, 'calls': 0})
+        entry['wall'] += time.perf_counter() - wall
+        entry['cpu'] += time.process_time() - cpu
+        entry['calls'] += 1
+
+
+def timed(name, iterable):
+    # iterate over iterable, the time spent producing every item (e.g. parsing a lazily read frame) goes to stage name
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def count(name, value=1):
+    # add value to counter name (frames, bytes, ...)
+    counters[name] = counters.get(name, 0) + value
+
+
+def count_file(name, path):
+    # add the size of a file to counter name
+    if os.path.exists(path):
+        count(name, os.path.getsize(path))
+
+
+def peak_rss():
+    # peak resident set size of this process in bytes (None where the resource module is not available)
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS:
+    return rss if sys.platform == 'darwin' else rss*1024
+
+
+def children_cpu():
+    # CPU time of finished worker processes
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def summary(script, wall, cpu):
+    return {'script': script, 'argv': sys.argv[1:], 'wall': wall, 'cpu': cpu, 'children_cpu': children_cpu(),
+            'peak_rss': peak_rss(), 'stages': stages, 'counters': counters}
+
+
+def add_arguments(parser):
+    parser.add_argument('--stats', type=str, default=None, help='write a JSON summary of the run (time per stage, frames, bytes, peak memory) to this file')
+    parser.add_argument('--profile', action='store_true', help='run in cProfile, the statistics are written to --profile-output and the top functions are printed')
+    parser.add_argument('--profile-output', type=str, default='prism.prof', help='file for the cProfile statistics of --profile (default: prism.prof)')
+
+
+@contextlib.contextmanager
+def session(script, args):
+    # instrument the enclosed run of script, args are the parsed arguments (see add_arguments). The output paths are
+    # relative to the working directory, they are printed as absolute paths.
+    stats_path = os.path.abspath(args.stats) if args.stats else None
+    profile_path = os.path.abspath(args.profile_output) if args.profile else None
+
+    profiler = None
+    if profile_path is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+
+        if profiler is not None:
+            import pstats
+            profiler.dump_stats(profile_path)
+            print("Profile written to",profile_path)
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+
+        if stats_path is not None:
+            with open(stats_path, 'w') as f:
+                json.dump(summary(script, wall, cpu), f, indent=1, sort_keys=True)
+            print("Run summary written to",stats_path)
+            for name, entry in sorted(stages.items(), key=lambda item: -item[1]['wall']):
+                print("  ",name,": ",round(entry['wall'], 2),"s wall, ",round(entry['cpu'], 2),"s CPU, ",entry['calls'],"calls")
@@ -1,100 +1,335 @@
-import matplotlib.pyplot as plt
 import numpy as np
 import os
-
-def OpenTimeSeries(path,path_output):
+import sys
+
+import buildcache
+import datfile
+import framerender
+import frametable
+import perfstats
+import xtime
+
+# plot settings (value color scale: -15..0), also recorded in the rebuild manifest:
+VMIN = -15
+VMAX = 0
+CMAP = 'hot'
+DPI = 100
+
+
+def plot_params(grid, backend='matplotlib'):
+    # everything that changes the rendered frames, outputs are rebuilt if one of these changes.
+    # grid: (origin_N, origin_Z, DIM_N, DIM_Z) of the plotted region
+    return {'grid': list(grid), 'vmin': VMIN, 'vmax': VMAX, 'cmap': CMAP, 'dpi': DPI, 'backend': backend}
+
+
+def frame_output_path(path_output, name, timestep):
+    return path_output+name+'_'+str(timestep)+'.png'
+
+
+def video_output_path(path_output, name, video):
+    # streamed animation of a time series, video is the format (file extension, e.g. 'mp4' or 'gif')
+    return path_output+name+'.'+video
+
+
+def _render_frames(frames, name, path_output, origin_N, origin_Z, backend, png, images):
+    # render every (timestep, header, grid) of the frames iterator: the PNG is written if png is set, yields the RGB
+    # image of every frame if images is set (None otherwise)
+    current_index = -1
+    renderer = None
+    for current_index, header, data_y_2d in perfstats.timed('read', frames):
+        print("Plotting, time:",current_index,"        ", end="\r", flush=True)
+
+        # Create mesh grid with the dimensions of the data (DIM_Z x DIM_N) and the figure (fire color scale, color
+        # bar), both are reused for all frames of the same shape
+        if renderer is None or renderer.shape != data_y_2d.shape:
+            if renderer is not None:
+                renderer.close()
+            A, Z = np.meshgrid(range(origin_N, origin_N+data_y_2d.shape[1]), range(origin_Z, origin_Z+data_y_2d.shape[0]))
+            renderer = framerender.create_renderer(backend, A, Z, VMIN, VMAX, CMAP, DPI)
+
+        # save plot into into subfolder "time":
+        if png:
+            with perfstats.stage('render'):
+                renderer.render(data_y_2d, frame_output_path(path_output, name, current_index))
+            perfstats.count_file('bytes_out', frame_output_path(path_output, name, current_index))
+        image = None
+        if images:
+            with perfstats.stage('frame'):
+                image = renderer.frame(data_y_2d)
+        perfstats.count('frames')
+        yield image
+
+    if renderer is not None:
+        renderer.close()
+
+    print("Plotting, time:",current_index,"        ")
+
+
+def PlotTimeSeries(frames, name, path_output, origin_N=0, origin_Z=0, backend='matplotlib', video=None, png=True, fps=framerender.VIDEO_FPS):
+    # plot every (timestep, header, grid) of the frames iterator, frames are consumed one at a time.
+    # The first cell of the grids is (origin_N, origin_Z), axes show absolute N and Z. backend: see framerender.py.
+    # video: format of an animation (e.g. 'mp4' or 'gif') the frames are streamed into, PNGs are optional then
+    images = _render_frames(frames, name, path_output, origin_N, origin_Z, backend, png, video is not None)
+    framerender.write_frames(images, None if video is None else video_output_path(path_output, name, video), fps)
+
+
+# renderers and byte-offset indices of a worker process (PlotTimeSeriesParallel), kept for all chunks it renders:
+_worker_renderers = {}
+_worker_indices = {}
+
+
+def _render_chunk(path, frames, name, path_output, grid, backend, png=True, images=False):
+    # worker: render frames (indices into the .dat file or into the byte-offset index of a text file), the frames
+    # are read by the worker itself. Returns the number of frames, the last timestep and, if images is set, the RGB
+    # images of the frames (for a streamed video)
+    origin_N, origin_Z, DIM_N, DIM_Z = grid
+    if path.endswith('.dat'):
+        source = datfile.iter_timesteps(path, frames)
+    else:
+        if path not in _worker_indices:
+            _worker_indices[path] = xtime.open_index(path)
+        source = xtime.iter_indexed_timesteps(path, DIM_N, DIM_Z, frames, _worker_indices[path], origin_N, origin_Z)
+
+    current_index = None
+    rendered = [] if images else None
+    for current_index, header, data_y_2d in source:
+        key = (data_y_2d.shape, origin_N, origin_Z, backend)
+        if key not in _worker_renderers:
+            A, Z = np.meshgrid(range(origin_N, origin_N+data_y_2d.shape[1]), range(origin_Z, origin_Z+data_y_2d.shape[0]))
+            _worker_renderers[key] = framerender.create_renderer(backend, A, Z, VMIN, VMAX, CMAP, DPI)
+        if png:
+            _worker_renderers[key].render(data_y_2d, frame_output_path(path_output, name, current_index))
+        if images:
+            rendered.append(np.array(_worker_renderers[key].frame(data_y_2d)))
+    return len(frames), current_index, rendered
+
+
+def _render_parallel(path, frames, name, path_output, grid, backend, jobs, png, images):
+    # progress of the worker pool, yields the images of the frames in order (None if images is not set)
+    import time
+    start_time = time.time()
+
+    done = 0
+    current_index = -1
+    tasks = ((path, frames[start:end], name, path_output, grid, backend, png, images) for start, end in framerender.frame_chunks(len(frames), jobs))
+    # the workers are not instrumented, 'render' is the time spent waiting for them:
+    for count, last, rendered in perfstats.timed('render', framerender.render_pool(_render_chunk, tasks, jobs)):
+        done += count
+        perfstats.count('frames', count)
+        if last is not None:
+            current_index = last
+        print("Plotting, time:",current_index,"(",done,"/",len(frames),"frames",framerender.progress_string(done, len(frames), start_time),")        ", end="\r", flush=True)
+        for image in (rendered if images else [None]*count):
+            yield image
+
+    print("Plotting, time:",current_index,"        ")
+
+
+def PlotTimeSeriesParallel(path, frames, name, path_output, grid, backend, jobs, video=None, png=True, fps=framerender.VIDEO_FPS):
+    # like PlotTimeSeries, but chunks of frames are rendered by jobs worker processes, each with its own figure.
+    # Only frame indices are sent to the workers (they map the .dat file or seek in the text file themselves),
+    # outputs are the same as rendering serially. For a video the workers send back the images, they are written
+    # in frame order.
+    images = _render_parallel(path, frames, name, path_output, grid, backend, jobs, png, video is not None)
+    framerender.write_frames(images, None if video is None else video_output_path(path_output, name, video), fps)
+
+
+def _iter_changed_timesteps(path, name, path_output, cached, digests, grid):
+    # like xtime.iter_timesteps, but blocks whose digest matches the last run (and whose PNG exists) are skipped
+    # before they are parsed. The digest of every block is stored in digests.
+    for header, body in xtime.read_blocks(path):
+        fields = xtime.parse_header(header)
+        timestep = fields['timestep']
+        digests[timestep] = buildcache.frame_digest(header, body)
+        if cached.get(timestep) == digests[timestep] and os.path.exists(frame_output_path(path_output, name, timestep)):
+            continue
+
+        data_Z, data_A, abundance = xtime.parse_block(body)
+        origin_N, origin_Z, DIM_N, DIM_Z = grid
+        yield timestep, fields, xtime.rasterize(data_Z, data_A, abundance, DIM_N, DIM_Z, origin_N, origin_Z)
+
+
+def _spool_timesteps(path, digests=None, frames=None, index=None):
+    # one parse pass over a text file whose extent is not known yet: returns the extent (also stored in the byte-offset
+    # index) and a spool of all parsed blocks, rendered by _iter_spool. The digest of every block is stored in digests
+    # if given (see _iter_changed_timesteps). With frames (indices into the index) only these blocks are parsed, their
+    # extent is not stored.
+    spool = xtime.ColumnSpool(np.float64)
+    extent = None
+    blocks = xtime.read_blocks(path) if frames is None else xtime.read_indexed_blocks(path, frames, index)
+    for header, body in perfstats.timed('read', blocks):
+        timestep = xtime.parse_timestep(header)
+        print("Parsing, time:",timestep,"        ", end="\r", flush=True)
+        if digests is not None:
+            digests[timestep] = buildcache.frame_digest(header, body)
+        with perfstats.stage('parse'):
+            Z, N, values = xtime.parse_columns(body)
+        extent = xtime.merge_extent(extent, xtime.block_extent(Z, N))
+        spool.append(timestep, Z, N, values)
+    if frames is None:
+        xtime.save_extent(path, extent)
+    return extent, spool
+
+
+def _iter_spool(spool, grid, name=None, path_output=None, cached=None, digests=None):
+    # frames of a spool (see _spool_timesteps) on the grid, the spool is closed at the end. With cached, frames whose
+    # digest matches the last run (and whose PNG exists) are skipped like in _iter_changed_timesteps
+    origin_N, origin_Z, DIM_N, DIM_Z = grid
+    try:
+        for timestep, Z, N, values in spool:
+            if cached is not None and cached.get(timestep) == digests[timestep] and os.path.exists(frame_output_path(path_output, name, timestep)):
+                continue
+            yield timestep, None, xtime.rasterize_cells(Z, N, values, DIM_N, DIM_Z, origin_N, origin_Z)
+    finally:
+        spool.close()
+
+
+def _iter_changed_frames(frames, name, path_output, cached, digests):
+    # same for already loaded frames (.dat files), the digest is taken over the grid
+    for timestep, header, grid in frames:
+        digests[timestep] = buildcache.frame_digest(np.ascontiguousarray(grid).tobytes())
+        if cached.get(timestep) == digests[timestep] and os.path.exists(frame_output_path(path_output, name, timestep)):
+            continue
+        yield timestep, header, grid
+
+
+def _changed_positions(items, name, path_output, cached, digests):
+    # positions of the frames that have to be rendered again, items are the (timestep, digest) of all frames in order.
+    # Used to hand the changed frames to PlotTimeSeriesParallel.
+    changed = []
+    for position, (timestep, digest) in enumerate(items):
+        digests[timestep] = digest
+        if cached.get(timestep) == digest and os.path.exists(frame_output_path(path_output, name, timestep)):
+            continue
+        changed.append(position)
+    return np.array(changed, dtype=np.int64)
+
+
+def OpenTimeSeries(path,path_output,ranges=None,manifest=None,backend='matplotlib',jobs=1,video=None,png=True,fps=framerender.VIDEO_FPS):
     print("Plotting",path,"using time series approach.")
-
-    # Data format example (blocks continue like this but with different amount of data points):
-    # timestep      3   time(s)  0.184731E-01   temperature(GK) 0.100000E+02   density(g/cm^3) 0.531701E+08   radius(arb.units) 0.100000E+09
-    # 0     1    0.899782E+00
-    # 1     1    0.997817E-01
-    # 1     2    0.436210E-03
-    # 1     3    0.479214E-06
-    # 2     3    0.220333E-07
-    # 2     4    0.181096E-09
-
-    # we need to iterate line by line and extract the third column of every block that starts with 'timestep':
-    with open(path) as f:
-        current_index = -1
-        data_list = [] # structured data, N,Z,abundance 
-        # loop over lines:
-        for line in f:
-            if line.startswith('timestep'): # if line starts with 'timestep', it's metadata otherwise it's data, if metadata: first column is "timestep", second column is current_index (to be extracted)
-                # if current index is set, plot data_list, reset it and continue
-                if current_index > -1:
-                    # plot y:
-                    # print(data_list)
-                    print("Plotting, time:",current_index,"        ", end="\r", flush=True)
-
-                    # plot 2d-grid with x=Z, y=A, z=abundance
-                    # grid dimensions: 150x150 (value color scale: -15..0)
-
-                    # Create mesh grid with dimensions 150x150
-                    DIM_N = 120
-                    DIM_Z = 120
-
-                    A, Z = np.meshgrid(range(DIM_N), range(DIM_Z))
-
-                    # Create a 2D array to hold the y data
-                    data_y_2d = np.full(A.shape, -15)  # Initialize with -15
-
-                    for data_point in data_list: # zip(data_list_N, data_list_Z, data_list_y):
-                        # range sanity check
-                        if data_point[0] < DIM_N and data_point[1] < DIM_Z:
-                            data_y_2d[data_point[1], data_point[0]] = data_point[2]
-
-                    # Now plot using data_y_2d with fire color scale
-                    plt.pcolormesh(A, Z, data_y_2d, vmin=-15, vmax=0, cmap='hot')
-
-                    #add color bar
-                    plt.colorbar()
-
-                    plt.xlabel('N')
-                    plt.ylabel('Z')
-
-
-                    # save plot into into subfolder "time":
-                    plt.savefig(path_output+path[:-4]+'_'+str(current_index)+'.png')
-                    plt.clf()
-
-                    # reset data_list:
-                    data_list = []
-
-
-                # extract current_index:
-                current_index = int(line.split()[1])
-            else:
-                # only continue if current_index is set:
-                if current_index > -1:
-                    # extract data:
-                    extract = line.split()
-                    if len(extract) > 2:
-                        data_Z = int(extract[0]) # Z
-                        data_A = int(extract[1]) # A
-                        data_y = float(extract[2]) # abundance
-
-                        # log scale (with sanity check)
-                        if data_y > 0:
-                            data_y = np.log10(data_y)
-                        else:
-                            data_y = -15
-
-                        # append to data_list:
-                        data_list.append( (data_A - data_Z, data_Z, data_y) )
-
-        print("Plotting, time:",current_index,"        "))
-
-
-def OpenBasicFile(file):
+    name = os.path.basename(path)[:-4]
+
+    # frame selection by header values, e.g. {'timestep': (4000, 4000)}: the selected blocks are looked up in the
+    # byte-offset index (built once and stored next to the file), seeked to and parsed directly
+    index = xtime.open_index(path)
+    frames = index.table.select_ranges(ranges) if ranges else None
+
+    # the grid covers the (N, Z) extent of the data (found once and kept in the byte-offset index). If it is not known
+    # yet, a serial run finds it in the parse pass that rendering needs anyway: the parsed blocks are spooled and
+    # rendered from the spool, so the file is parsed only once. A selection is sized from its own blocks, the whole
+    # file is only scanned for full renders.
+    spool = None
+    digests = {}
+    if index.extent is not None:
+        extent = index.extent
+    elif jobs == 1:
+        extent, spool = _spool_timesteps(path, digests if manifest is not None and video is None and not ranges else None, frames, index)
+    elif ranges:
+        extent = xtime.indexed_extent(path, frames, index)
+    else:
+        extent = xtime.data_extent(path, jobs)
+    grid = xtime.grid_extent(extent)
+    origin_N, origin_Z, DIM_N, DIM_Z = grid
+
+    if ranges:
+        if jobs > 1:
+            PlotTimeSeriesParallel(path, frames, name, path_output, grid, backend, jobs, video, png, fps)
+        elif spool is not None:
+            PlotTimeSeries(_iter_spool(spool, grid), name, path_output, origin_N, origin_Z, backend, video, png, fps)
+        else:
+            PlotTimeSeries(xtime.iter_indexed_timesteps(path, DIM_N, DIM_Z, frames, index, origin_N, origin_Z), name, path_output, origin_N, origin_Z, backend, video, png, fps)
+        return
+
+    # a video always needs all frames, the manifest is not used then:
+    if manifest is None or video is not None:
+        if jobs > 1:
+            # workers seek to the blocks through the byte-offset index:
+            PlotTimeSeriesParallel(path, np.arange(len(index)), name, path_output, grid, backend, jobs, video, png, fps)
+        elif spool is not None:
+            PlotTimeSeries(_iter_spool(spool, grid), name, path_output, origin_N, origin_Z, backend, video, png, fps)
+        else:
+            # parse 'timestep' blocks lazily into DIM_Z x DIM_N grids of log10 abundances and plot them:
+            PlotTimeSeries(xtime.iter_timesteps(path, DIM_N, DIM_Z, origin_N=origin_N, origin_Z=origin_Z), name, path_output, origin_N, origin_Z, backend, video, png, fps)
+        return
+
+    # incremental: skip the file if nothing changed, otherwise only render frames that changed
+    params = plot_params(grid, backend)
+    if manifest.is_current(path, params):
+        print("Skipping",path,"(up to date).")
+        if spool is not None:
+            spool.close()
+        return
+
+    if jobs > 1:
+        blocks = ((xtime.parse_header(header)['timestep'], buildcache.frame_digest(header, body)) for header, body in xtime.read_blocks(path))
+        PlotTimeSeriesParallel(path, _changed_positions(blocks, name, path_output, manifest.frames(path, params), digests), name, path_output, grid, backend, jobs)
+    elif spool is not None:
+        PlotTimeSeries(_iter_spool(spool, grid, name, path_output, manifest.frames(path, params), digests), name, path_output, origin_N, origin_Z, backend)
+    else:
+        PlotTimeSeries(_iter_changed_timesteps(path, name, path_output, manifest.frames(path, params), digests, grid), name, path_output, origin_N, origin_Z, backend)
+    manifest.record(path, params, [frame_output_path(path_output, name, timestep) for timestep in digests], digests)
+
+
+def OpenBinaryTimeSeries(path,path_output,ranges=None,manifest=None,backend='matplotlib',jobs=1,video=None,png=True,fps=framerender.VIDEO_FPS):
+    print("Plotting",path,"using binary time series approach.")
+    name = os.path.basename(path)[:-4]
+
+    # optional frame selection by header values, looked up in the metadata sidecar:
+    frames = None
+    if ranges:
+        table = frametable.FrameTable.load(path)
+        if table is None:
+            print("Error: No metadata sidecar for",path,"- convert it again to select frames by range.")
+            return
+        frames = table.select_ranges(ranges)
+
+    # region covered by the file, the frames are counted like the readers do (a damaged directory is scanned):
+    dat = datfile.DatFile(path)
+    origin_N, origin_Z = dat.origin_N, dat.origin_Z
+    grid = (origin_N, origin_Z, dat.DIM_N, dat.DIM_Z)
+    if frames is not None and np.any(frames >= len(dat)):
+        print("Warning: The metadata sidecar of",path,"lists more frames than the file has (truncated?), plotting the first",len(dat),"frames only.")
+        frames = frames[frames < len(dat)]
+
+    # a video always needs all selected frames, the manifest is not used then:
+    if ranges or manifest is None or video is not None:
+        if jobs > 1:
+            # workers map the .dat file themselves:
+            PlotTimeSeriesParallel(path, frames if frames is not None else np.arange(len(dat)), name, path_output, grid, backend, jobs, video, png, fps)
+        else:
+            # frames are read lazily from the .dat file written by plot2D_to_binary.py:
+            PlotTimeSeries(datfile.iter_timesteps(path, frames), name, path_output, origin_N, origin_Z, backend, video, png, fps)
+        return
+
+    # incremental: skip the file if nothing changed, otherwise only render frames that changed
+    params = plot_params(grid, backend)
+    if manifest.is_current(path, params):
+        print("Skipping",path,"(up to date).")
+        return
+
+    digests = {}
+    if jobs > 1:
+        frames = ((timestep, buildcache.frame_digest(np.ascontiguousarray(data).tobytes())) for timestep, fields, data in datfile.iter_timesteps(path))
+        PlotTimeSeriesParallel(path, _changed_positions(frames, name, path_output, manifest.frames(path, params), digests), name, path_output, grid, backend, jobs)
+    else:
+        PlotTimeSeries(_iter_changed_frames(datfile.iter_timesteps(path), name, path_output, manifest.frames(path, params), digests), name, path_output, origin_N, origin_Z, backend)
+    manifest.record(path, params, [frame_output_path(path_output, name, timestep) for timestep in digests], digests)
+
+
+def OpenBasicFile(file,manifest=None):
     # "basic" approach
+    if manifest is not None and manifest.is_current(file, {}):
+        print("Skipping",file,"(up to date).")
+        return
+
     print("Plotting",file,"using basic approach.")
+    import matplotlib.pyplot as plt
 
     # load file:
     data = np.loadtxt(file)
     # plot x-y:
     plt.plot(data[:,0],data[:,1])
-    plt.legend(file)
+    plt.legend(os.path.basename(file))
 
     plt.xlabel('x')
     plt.ylabel('y')
@@ -103,45 +338,112 @@ def OpenBasicFile(file):
     plt.savefig(file[:-4]+'.png')
     plt.clf()
 
+    if manifest is not None:
+        manifest.record(file, {}, [file[:-4]+'.png'])
+
+
+def _plot_task(task):
+    # worker (buildcache.run_batch): plot one file, returns its manifest entry
+    path, output_path, ranges, force, backend, jobs, video, png, fps = task
+    manifest = None if force else buildcache.Manifest(output_path)
+    file = os.path.basename(path)
+    # if path contains "XTime", we need a more sophisticated way to load the data:
+    if file.endswith('.txt') and 'Time' in file:
+        OpenTimeSeries(path,output_path,ranges,manifest,backend,jobs,video,png,fps)
+    elif file.endswith('.txt'):
+        OpenBasicFile(path,manifest)
+    else:
+        OpenBinaryTimeSeries(path,output_path,ranges,manifest,backend,jobs,video,png,fps)
+    return None if manifest is None else manifest.entry(path)
+
+
+def _superseded(path):
+    # the .dat file of a run and the text file it was converted from (same name and folder) render to the same frames,
+    # only one of them is plotted: the .dat file if it is at least as new as the text file, otherwise the text file.
+    # Returns the file that is plotted instead of path, None if path is plotted
+    other = path[:-4]+('.txt' if path.endswith('.dat') else '.dat')
+    if not os.path.exists(other):
+        return None
+    if path.endswith('.dat'):
+        return None if os.path.getmtime(path) >= os.path.getmtime(other) else other
+    return other if os.path.getmtime(other) >= os.path.getmtime(path) else None
+
+
+def plot_dir_contents(input_folder, output_path, ranges=None, force=False, backend='matplotlib', jobs=1, video=None, png=True, fps=framerender.VIDEO_FPS, file_jobs=1):
+    #### load all files in the directory and plot x-y, output_path is relative to input_folder.
+    # With file_jobs > 1 a pool of processes plots that many files at once (jobs workers each), largest file first.
+    # Returns the files that failed, the others are plotted anyway.
+    output_path = os.path.join(input_folder, output_path)
 
-def plot_dir_contents(input_folder, output_path):
-    #### load all files in the directory and plot x-y
-    # get list of output_dir contents:
-    os.chdir(input_folder)
-
-    #### load all files in the directory and plot x-y
     # get list of directory contents:
-    files = os.listdir()
+    files = os.listdir(input_folder)
 
     # if it does not exist yet, create subfolder "time":
     if not os.path.exists(output_path):
         os.makedirs(output_path)
 
-    # loop over txt files:
-    for file in files:
-        if file.endswith('.txt'):
-            # if path contains "XTime", we need a more sophisticated way to load the data:
-            if 'Time' in file:
-                OpenTimeSeries(file,output_path)
-
-            else:
-                OpenBasicFile(file)
-
-
+    # rebuild manifest: unchanged files and frames are skipped (unless force is set)
+    manifest = None if force else buildcache.Manifest(output_path)
+
+    # txt files and binary time series (.dat files with "Time" in the name):
+    paths = [os.path.join(input_folder, file) for file in files if file.endswith('.txt') or (file.endswith('.dat') and 'Time' in file)]
+    for path in paths[:]:
+        if path.endswith('.dat') or 'Time' in os.path.basename(path):
+            instead = _superseded(path)
+            if instead is not None:
+                print("Skipping",path,"(same frames as",instead+").")
+                paths.remove(path)
+    paths = buildcache.largest_first(paths)
+    tasks = [(path, output_path, ranges, force, backend, jobs, video, png, fps) for path in paths]
+
+    failed = []
+    for task, entry, output, error in buildcache.run_batch(_plot_task, tasks, file_jobs):
+        if output:
+            print(output)
+        if error is not None:
+            print("Error: Plotting",task[0],"failed:",error)
+            failed.append(task[0])
+            continue
+
+        # save after every file, so an interrupted run keeps its progress:
+        if manifest is not None:
+            manifest.merge(task[0], entry)
+            manifest.save()
+
+    if failed:
+        print("Failed:",len(failed),"of",len(tasks),"files:",', '.join(failed))
+    return failed
+
+
+def add_arguments(parser):
+    # command line options (this script and "prism.py plot")
+    parser.add_argument('input_folder', type=str, help='The folder containing the text files and binary time series.')
+    parser.add_argument('output_path', type=str, help='Output folder of the frames, relative to input_folder.')
+    parser.add_argument('--force', action='store_true', help='Render everything, even if the outputs are up to date.')
+    parser.add_argument('--backend', choices=framerender.BACKENDS, default='matplotlib', help='matplotlib figures or the fast raster output (no axes).')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of worker processes that render frames.')
+    parser.add_argument('--file-jobs', type=int, default=1, help='Number of files plotted at once (worker processes, largest file first).')
+    parser.add_argument('--video', type=str, default=None, help='Stream the frames of every time series into an animation of this format (e.g. mp4 or gif), named after the file.')
+    parser.add_argument('--fps', type=int, default=framerender.VIDEO_FPS, help='Frame rate of the animation (with --video).')
+    parser.add_argument('--no-png', action='store_true', help='Do not write PNG frames (with --video).')
+    frametable.add_range_arguments(parser)
+    perfstats.add_arguments(parser)
+
+
+def main(args):
+    if args.no_png and args.video is None:
+        print("Error: --no-png needs --video")
+        sys.exit(2)
+
+    with perfstats.session('plot2D', args):
+        failed = plot_dir_contents(args.input_folder, args.output_path, frametable.ranges_from_args(args), args.force, args.backend, args.jobs, args.video, not args.no_png, args.fps, args.file_jobs)
+    if failed:
+        sys.exit(1)
 
 
-# main method, read input_folder, output_path and delay from command line arguments
+# main method, read input_folder, output_path and options from command line arguments
 if __name__ == '__main__':
-    import sys
-    if not (len(sys.argv) in [3]):
-        print('Usage: python to_binary.py <input_folder> <output_path>')
-        sys.exit(1)
-
-    # read arguments:
     import argparse
-    parser = argparse.ArgumentParser(description='Create a gif from a folder of png files.')
-    parser.add_argument('input_folder', type=str, help='The folder containing the png files.')
-    parser.add_argument('output_path', type=str, help='The path to the output gif file.')
-    args = parser.parse_args()
-
-    plot_dir_contents(args.input_folder, args.output_path)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Plot the text files and time series of a folder as nuclide charts.')
+    add_arguments(parser)
+    main(parser.parse_args())
@@ -1,9 +1,11 @@
-import matplotlib.pyplot as plt
 import numpy as np
 import os
+import sys
 
-max_diff = 0.0
-min_diff = 0.0
+import datfile
+import framerender
+import frametable
+import perfstats
 
 # define data series entry class with timestep and data:
 class DataSeriesEntry:
@@ -12,32 +14,11 @@ class DataSeriesEntry:
         self.data = data
 
 def ReadDataFromFile(file, DIM_N, DIM_Z):
-    # data is structured in blocks, we'll keep reading blocks until EOF:
-    data_array = []
-    timestep = 0
-    while True:
-        # try to read timestep, if EOF, break:
-        try:
-            # read first 4 bytes as int32:
-            timestep_bytes = file.read(4)
-            if len(timestep_bytes) == 0:
-                print("Reached EOF after reading",len(data_array),"timesteps. Last timestep:",timestep)
-                break
-
-            timestep = int.from_bytes(timestep_bytes, byteorder='little', signed=True)
-        except:
-            print("Failed to convert timestep to int32 or reached EOF after reading",len(data_array),"timesteps.")
-            break
-
-        # read data amount (DIM_N1*DIM_Z1*4 bytes):
-        data = np.frombuffer(file.read(DIM_N*DIM_Z*4), dtype=np.float32)
-        # reshape data:
-        data = data.reshape(DIM_N, DIM_Z)
-
-        # append tuple to data_array:
-        data_array.append( (timestep, data) )
-
-    return data_array
+    # frames are yielded lazily as (timestep, data) tuples from the mapped file (version 1 or 2),
+    # so only the frames that are used are read from disk:
+    dat = datfile.DatFile(file.name)
+    for index in range(len(dat)):
+        yield dat[index]
 
 
 def load_reference_isotopes(path):
@@ -71,184 +52,533 @@ def load_reference_isotopes(path):
     return list_of_isotopes
 
 
-def CompareTimeSeries(path1, path2, reference_isotopes, path_out, delta_TS, output_range, threshold, DIM_N_limit, DIM_Z_limit):
-    global max_diff
-    global min_diff
+# ways to find the frame of file 2 that belongs to a frame of file 1:
+#   timestep: the frame with timestep1 + delta_TS
+#   nearest:  the frame whose physical time (header time(s)) is closest to time1 + delta_TS
+#   linear:   linear interpolation between the two frames whose times enclose time1 + delta_TS
+ALIGN_MODES = ('timestep', 'nearest', 'linear')
+
+
+def match_frames(dat1, dat2, frames1, delta_TS, align, table1=None, table2=None):
+    # (lower, upper, weight) frame indices of file 2 for every frame of file 1 (one join over all frames, -1 where
+    # there is no match). Frame 2 is (1-weight)*frames2[lower] + weight*frames2[upper].
+    frames1 = np.asarray(frames1, dtype=np.int64)
+    if align == 'timestep':
+        index2 = dat2.frames_of(dat1.timesteps[frames1] + delta_TS)
+        return index2, index2, np.zeros(len(frames1))
+
+    lower, upper, weight = table2.bracket('time', table1.columns['time'][frames1] + delta_TS)
+    if align == 'nearest':
+        lower = upper = np.where(weight < 0.5, lower, upper)
+        weight = np.zeros(len(frames1))
+    return lower, upper, weight
+
+
+# frames per stacked array in the screening pass:
+SCREEN_BATCH = 256
+
+# per-frame statistics of the screening pass (in this order in the report):
+STAT_COLUMNS = ('min', 'max', 'mean_abs', 'rms')
+
+
+def diff_frames(dat1, dat2, index1, lower2, upper2, weight2, box):
+    # stacked (len(index1), DIM_Z, DIM_N) differences of the log10 abundances (file 2 - file 1) on the grid box,
+    # frames of file 2 as returned by match_frames (all matched)
+    data1 = datfile.place(dat1.read_frames(index1), dat1.origin_N, dat1.origin_Z, box, dat1.fill_value)
+    data2 = dat2.read_frames(lower2)
+    if np.any(weight2 > 0):
+        # interpolated in log10 abundance:
+        weight = np.asarray(weight2)[:, None, None]
+        data2 = (1 - weight)*data2 + weight*dat2.read_frames(upper2)
+    data2 = datfile.place(data2, dat2.origin_N, dat2.origin_Z, box, dat2.fill_value)
+    return data2 - data1
+
+
+def screen_frames(dat1, dat2, frames1, lower2, upper2, weight2, box):
+    # per-frame min, max, mean absolute and RMS difference of all frames (NaN where file 2 has no match), computed
+    # as reductions over stacks of SCREEN_BATCH frames
+    stats = {name: np.full(len(frames1), np.nan) for name in STAT_COLUMNS}
+    matched = np.flatnonzero(lower2 >= 0)
+    for start in range(0, len(matched), SCREEN_BATCH):
+        rows = matched[start:start+SCREEN_BATCH]
+        print("Screening: ",start+len(rows),"/",len(matched),"        ",end='\r', flush=True)
+
+        with perfstats.stage('diff'):
+            diff = diff_frames(dat1, dat2, frames1[rows], lower2[rows], upper2[rows], weight2[rows], box)
+        with perfstats.stage('screen'):
+            stats['min'][rows] = diff.min(axis=(1, 2))
+            stats['max'][rows] = diff.max(axis=(1, 2))
+            stats['mean_abs'][rows] = np.abs(diff).mean(axis=(1, 2), dtype=np.float64)
+            stats['rms'][rows] = np.sqrt(np.square(diff, dtype=np.float64).mean(axis=(1, 2)))
+        perfstats.count('frames_screened', len(rows))
+    return stats
+
+
+def write_report(path, timesteps1, timesteps2, weight2, stats, passed):
+    # one CSV line per frame of file 1: matched timestep of file 2 (-1 if none; lower frame and weight for linear
+    # alignment), statistics of the difference and whether the frame passed the threshold
+    with open(path, 'w') as f:
+        f.write('timestep1,timestep2,weight,'+','.join(STAT_COLUMNS)+',passed\n')
+        for i in range(len(timesteps1)):
+            values = ','.join('%.6g' % stats[name][i] for name in STAT_COLUMNS)
+            f.write('%d,%d,%.6g,%s,%d\n' % (timesteps1[i], timesteps2[i], weight2[i], values, passed[i]))
+
+
+def compare_box(dat1, dat2, DIM_N_limit, DIM_Z_limit):
+    # compared region (origin_N, origin_Z, DIM_N, DIM_Z): both grids, cut at N < DIM_N_limit and Z < DIM_Z_limit.
+    # None if nothing is left.
+    origin_N, origin_Z, DIM_N, DIM_Z = datfile.union_box(dat1, dat2)
+    DIM_N = min(DIM_N, DIM_N_limit - origin_N)
+    DIM_Z = min(DIM_Z, DIM_Z_limit - origin_Z)
+    if DIM_N <= 0 or DIM_Z <= 0:
+        return None
+    return (origin_N, origin_Z, DIM_N, DIM_Z)
+
+
+def run_extremes(stats):
+    # largest and smallest diff of a run (starting at 0, like the running values of the original loop)
+    if np.all(np.isnan(stats['max'])):
+        return 0.0, 0.0
+    return max(0.0, np.nanmax(stats['max'])), min(0.0, np.nanmin(stats['min']))
+
+
+def create_diff_renderer(box, output_range, list_of_isotopes, backend='matplotlib'):
+    # figure with mesh (seismic color scale), colorbar, reference isotopes and shell closures, built once per region
+    # Create mesh grid with dimensions DIM_N x DIM_Z (absolute N and Z)
+    origin_N, origin_Z, DIM_N, DIM_Z = box
+    A, Z = np.meshgrid(range(origin_N, origin_N+DIM_N), range(origin_Z, origin_Z+DIM_Z))
 
-    list_of_isotopes = load_reference_isotopes(reference_isotopes)
+    magic_numbers_protons  = [2, 8, 20, 28, 50, 82]
+    magic_numbers_neutrons = [2, 8, 20, 28, 50, 82, 126] 
 
-    # load both files, format is the same as the write format (first header with dimensions, then data)
-    # Data is structured in blocks, each block has a timestep and a 2D array of abundances. For simplicity we assume that the dimensions are the same for both files (120x120),
-    # but we will still read the dimensions from the header to make sure and break if they are not the same.
+    renderer = framerender.create_renderer(backend, A, Z, -output_range, output_range, 'seismic', 280) #RdBu
+    renderer.add_isotope_boxes(list_of_isotopes)
+    renderer.add_shell_closures(magic_numbers_protons, magic_numbers_neutrons)
+    renderer.add_text()
+    return renderer
+
+
+def render_diff_frame(renderer, dat1, dat2, index1, lower2, upper2, weight2, box, current_max, current_min, path_out, max_diff, min_diff, png=True, image=False):
+    # render the diff of frame index1 of file 1 (matched frames of file 2, see match_frames) to path_out/diff_<timestep>.png
+    # (if png is set), returns the RGB image of the frame if image is set
+    timestep1 = int(dat1.timesteps[index1])
+    with perfstats.stage('diff'):
+        data_y_2d_diff = diff_frames(dat1, dat2, [index1], [lower2], [upper2], np.array([weight2]), box)[0]
+    # data_y_2d_diff = np.ma.masked_array(data_y_2d_diff, abs(data_y_2d_diff) < 0.0001)
+
+    # save plot, write timestep padded with zeroes. Timestamp (top left) with the diff of this frame and of the whole run:
+    save_name = path_out+'/diff_'+str(timestep1).zfill(5)+'.png'
+    text = "timestep: "+str(timestep1)+"\nmax diff: "+str(round(current_max, 4))+" (run: "+str(round(max_diff, 4))+")\nmin diff: "+str(round(current_min, 4))+" (run: "+str(round(min_diff, 4))+")"
+    perfstats.count('frames')
+    if png:
+        with perfstats.stage('render'):
+            renderer.render(data_y_2d_diff, save_name, text)
+        perfstats.count_file('bytes_out', save_name)
+    if image:
+        with perfstats.stage('frame'):
+            return renderer.frame(data_y_2d_diff, text)
+    return None
+
+
+# files and renderers of a worker process (render_diff_frames with jobs > 1), kept for all chunks it renders:
+_worker_files = {}
+_worker_renderers = {}
+
+
+def _render_diff_chunk(path1, path2, frames1, lower2, upper2, weight2, current_max, current_min, box, path_out, output_range, list_of_isotopes, max_diff, min_diff, backend, png, images):
+    # worker: render a chunk of frames, the worker maps both files itself and only gets the frame indices. Returns the
+    # RGB images of the frames as well if images is set (for a streamed video)
+    for path in (path1, path2):
+        if path not in _worker_files:
+            _worker_files[path] = datfile.DatFile(path)
+    key = (box, output_range, tuple(list_of_isotopes), backend)
+    if key not in _worker_renderers:
+        _worker_renderers[key] = create_diff_renderer(box, output_range, list_of_isotopes, backend)
+
+    rendered = []
+    for i in range(len(frames1)):
+        image = render_diff_frame(_worker_renderers[key], _worker_files[path1], _worker_files[path2], frames1[i], lower2[i], upper2[i], weight2[i], box, current_max[i], current_min[i], path_out, max_diff, min_diff, png, images)
+        rendered.append(None if image is None else np.array(image))
+    return len(frames1), current_min[-1], current_max[-1], rendered
+
+
+def _render_diff_images(dat1, dat2, frames1, lower2, upper2, weight2, box, stats, rows, path_out, output_range, list_of_isotopes, max_diff, min_diff, backend, jobs, png, images):
+    # render the rows with progress output, yields the RGB image of every row in order (None if images is not set)
+    import time
+    start_time = time.time()
 
-    # create output directory (if it does not exist yet):
-    if not os.path.exists(path_out):
-        os.makedirs(path_out)
+    count = len(rows)
+    if jobs > 1:
+        tasks = ((dat1.path, dat2.path, frames1[rows[start:end]], lower2[rows[start:end]], upper2[rows[start:end]], weight2[rows[start:end]], stats['max'][rows[start:end]], stats['min'][rows[start:end]],
+                  box, path_out, output_range, list_of_isotopes, max_diff, min_diff, backend, png, images) for start, end in framerender.frame_chunks(count, jobs))
+        done = 0
+        # the workers are not instrumented, 'render' is the time spent waiting for them:
+        for rendered, current_min, current_max, chunk_images in perfstats.timed('render', framerender.render_pool(_render_diff_chunk, tasks, jobs)):
+            done += rendered
+            perfstats.count('frames', rendered)
+            print("Progress: ",done,"/",count,framerender.progress_string(done, count, start_time),"      Currend diff.= (",current_min,",",current_max,")                ",end='\r', flush=True)
+            for image in chunk_images:
+                yield image
+        return
+
+    renderer = create_diff_renderer(box, output_range, list_of_isotopes, backend)
+    for rendered_entries, i in enumerate(rows):
+        current_max = stats['max'][i]
+        current_min = stats['min'][i]
+        yield render_diff_frame(renderer, dat1, dat2, frames1[i], lower2[i], upper2[i], weight2[i], box, current_max, current_min, path_out, max_diff, min_diff, png, images)
+
+        # progress output, rounded to seconds
+        time_elapsed_time = time.time() - start_time
+        time_elapsed_string = "(elapsed: "+str(round(time_elapsed_time, 0))+"s"
+
+        time_remaining_string = ""
+        if rendered_entries >= 20:
+            time_remaining_time = (count - rendered_entries - 1)*time_elapsed_time/(rendered_entries + 1)
+            time_remaining_string = ", remaining: "+str(round(time_remaining_time, 0))+"s"
+
+        print("Progress: ",rendered_entries+1,"/",count,time_elapsed_string,time_remaining_string,")      Currend diff.= (",current_min,",",current_max,")                ",end='\r', flush=True)
 
-    # open file 1:
+    renderer.close()
+
+
+def render_diff_frames(dat1, dat2, frames1, lower2, upper2, weight2, box, stats, rows, path_out, output_range, list_of_isotopes, max_diff, min_diff, backend='matplotlib', jobs=1, video=None, png=True, fps=framerender.VIDEO_FPS):
+    # render the diff of the given rows (positions in frames1) to path_out/diff_<timestep>.png (backend: see
+    # framerender.py), with jobs > 1 chunks of rows are rendered by a pool of worker processes. video: format of an
+    # animation (e.g. 'mp4' or 'gif', written to path_out/diff.<video>) the frames are streamed into, PNGs are
+    # optional then
+    images = _render_diff_images(dat1, dat2, frames1, lower2, upper2, weight2, box, stats, rows, path_out, output_range, list_of_isotopes, max_diff, min_diff, backend, jobs, png, video is not None)
+    framerender.write_frames(images, None if video is None else path_out+'/diff.'+video, fps)
+
+
+def open_pair(path1, path2, delta_TS, ranges=None, align='timestep'):
+    # open both files and match their frames: (dat1, dat2, table1, frames1, lower2, upper2, weight2) or None on error
+    # (see match_frames). frames1 are the frames of file 1 to compare, optionally selected by header values.
+
+    # map both files (frames are only read from disk when they are used):
     try:
-        f1 = open(path1, 'rb')
-    except:
+        dat1 = datfile.DatFile(path1)
+    except (OSError, ValueError):
         print("Error: Could not open file 1:",path1)
-        return
+        return None
 
-    # open file 2:
     try:
-        f2 = open(path2, 'rb')
-    except:
+        dat2 = datfile.DatFile(path2)
+    except (OSError, ValueError):
         print("Error: Could not open file 2:",path2)
-        return
+        return None
 
-    # read header:
-    DIM_N1 = int.from_bytes(f1.read(4), byteorder='little', signed=True)
-    DIM_Z1 = int.from_bytes(f1.read(4), byteorder='little', signed=True)
+    print("File 1:",dat1.DIM_N,"x",dat1.DIM_Z,"from N =",dat1.origin_N,", Z =",dat1.origin_Z," (",path1,")")
+    print("File 2:",dat2.DIM_N,"x",dat2.DIM_Z,"from N =",dat2.origin_N,", Z =",dat2.origin_Z," (",path2,")")
 
-    # read header:
-    DIM_N2 = int.from_bytes(f2.read(4), byteorder='little', signed=True)
-    DIM_Z2 = int.from_bytes(f2.read(4), byteorder='little', signed=True)
+    # debug output:
+    print("File 1:",len(dat1),"timesteps.")
+    print("File 2:",len(dat2),"timesteps.")
 
-    print("File 1:",DIM_N1,"x",DIM_Z1," (",path1,")")
-    print("File 2:",DIM_N2,"x",DIM_Z2," (",path2,")")
+    # header values of both files (metadata sidecars), needed to select frames by range and to align by time:
+    table1 = table2 = None
+    if ranges or align != 'timestep':
+        table1 = frametable.FrameTable.load(path1)
+        table2 = frametable.FrameTable.load(path2)
+        if table1 is None or (align != 'timestep' and table2 is None):
+            print("Error: No metadata sidecar for file 1 or 2 - convert them again to select or align frames by header values.")
+            return None
 
-    # sanity check:
-    if DIM_N1 != DIM_N2 or DIM_Z1 != DIM_Z2:
-        print("Error: Dimensions of files do not match!")
-        return
+    # frames of file 1 to compare, optionally selected by header values:
+    frames1 = np.arange(len(dat1))
+    if ranges:
+        frames1 = table1.select_ranges(ranges)
+        print("File 1:",len(frames1),"timesteps selected.")
 
-    # read data:
-    data1 = ReadDataFromFile(f1, DIM_N1, DIM_Z1)
-    data2 = ReadDataFromFile(f2, DIM_N2, DIM_Z2)
+    # matching frames of file 2:
+    lower2, upper2, weight2 = match_frames(dat1, dat2, frames1, delta_TS, align, table1, table2)
+    print("File 2:",np.count_nonzero(lower2 >= 0),"matching timesteps (",align,"alignment ).")
 
-    # debug output:
-    print("File 1: Read",len(data1),"timesteps.")
-    print("File 2: Read",len(data2),"timesteps.")
+    return dat1, dat2, table1, frames1, lower2, upper2, weight2
+
+
+def CompareTimeSeries(path1, path2, reference_isotopes, path_out, delta_TS, output_range, threshold, DIM_N_limit, DIM_Z_limit, ranges=None, align='timestep', render=True, backend='matplotlib', jobs=1, video=None, png=True, fps=framerender.VIDEO_FPS):
+    list_of_isotopes = load_reference_isotopes(reference_isotopes)
+
+    # load both files, format is the same as the write format (first header with dimensions, then data)
+    # Data is structured in blocks, each block has a timestep and a 2D array of abundances. Every file covers its own
+    # (N, Z) region (origin and dimensions in the header), both are compared on the region that covers the two.
+
+    # create output directory (if it does not exist yet):
+    if not os.path.exists(path_out):
+        os.makedirs(path_out)
 
-    DIM_N1 = min(DIM_N1, DIM_N_limit)
-    DIM_Z1 = min(DIM_Z1, DIM_Z_limit)
+    with perfstats.stage('open'):
+        pair = open_pair(path1, path2, delta_TS, ranges, align)
+    if pair is None:
+        return
+    dat1, dat2, table1, frames1, lower2, upper2, weight2 = pair
 
-    # Create mesh grid with dimensions DIM_N x DIM_Z
-    A, Z = np.meshgrid(range(DIM_N1), range(DIM_Z1))
+    box = compare_box(dat1, dat2, DIM_N_limit, DIM_Z_limit)
+    if box is None:
+        print("Error: No data below the N/Z limits!")
+        return
 
     # For time tracking: get current time
     import time
     start_time = time.time()
 
-    magic_numbers_protons  = [2, 8, 20, 28, 50, 82]
-    magic_numbers_neutrons = [2, 8, 20, 28, 50, 82, 126] 
+    # first pass: statistics of every frame, frames are only rendered if the diff exceeds threshold in either direction
+    stats = screen_frames(dat1, dat2, frames1, lower2, upper2, weight2, box)
+    passed = (stats['max'] >= threshold) | (stats['min'] <= -threshold)
+    timesteps2 = np.where(lower2 >= 0, dat2.timesteps[np.maximum(lower2, 0)], -1)
 
-    rendered_entries = 0
+    # extremes of the whole run:
+    run_max, run_min = run_extremes(stats)
 
-    # loop over timesteps:
-    for i in range(len(data1)):
-        timestep1 = data1[i][0]
-        
-        # first: find corresponding timestep in data2:
-        for j in range(len(data2)):
-            timestep2 = data2[j][0]
-            if timestep2 == timestep1 + delta_TS:
-                data_y_2d_1 = data1[i][1]
-                data_y_2d_2 = data2[j][1]
+    with perfstats.stage('report'):
+        write_report(path_out+'/diff_report.csv', dat1.timesteps[frames1], timesteps2, weight2, stats, passed)
+    print("Screening: ",np.count_nonzero(passed),"of",len(frames1),"frames exceed the threshold, report written to",path_out+'/diff_report.csv',"(",round(time.time() - start_time, 1),"s )")
 
-                # debug output: max and min values:
-                # print("data_y_2d_1 max:",np.amax(data_y_2d_1),"min:",np.amin(data_y_2d_1))
-                # print("data_y_2d_2 max:",np.amax(data_y_2d_2),"min:",np.amin(data_y_2d_2))
+    # second pass: render the frames that passed
+    if render:
+        render_diff_frames(dat1, dat2, frames1, lower2, upper2, weight2, box, stats, np.flatnonzero(passed), path_out, output_range, list_of_isotopes, run_max, run_min, backend, jobs, video, png, fps)
 
+    print("Done.         ")
 
-                # found corresponding timestep, now calculate difference as element wise ratio of data1/data2:
-                # if data2 element is 0, set difference to DEFAULT_DIFF_0:
-                
-                # print content of data_y_2d_1 and data_y_2d_2:
-                # print("data_y_2d_1:")
-                # print(data_y_2d_1)
 
-                data_y_2d_diff = data_y_2d_2 - data_y_2d_1
-                # data_y_2d_diff = np.ma.masked_array(data_y_2d_diff, abs(data_y_2d_diff) < 0.0001)
+def CompareIsotopes(path1, path2, reference_isotopes, path_out, delta_TS, ranges=None, align='timestep', top_k=10):
+    # per-isotope analytics instead of frames: the (Z, N) cells of all reference isotopes are gathered from all
+    # matched frames of both files at once, the deviation (log10 abundance file 2 - file 1) of every isotope and
+    # frame is written to isotopes_deviation.npz, the ranking of the isotopes to isotopes_summary.csv and the top_k
+    # isotopes of every frame to isotopes_topk.csv.
+    list_of_isotopes = load_reference_isotopes(reference_isotopes)
+    if len(list_of_isotopes) == 0:
+        print("Error: No reference isotopes in",reference_isotopes)
+        return
 
-                # cut data_y_2d_diff to be of proper size:
-                data_y_2d_diff = data_y_2d_diff[:DIM_Z1, :DIM_N1]
+    if not os.path.exists(path_out):
+        os.makedirs(path_out)
 
-                current_max = np.amax(data_y_2d_diff)
-                current_min = np.amin(data_y_2d_diff)
+    with perfstats.stage('open'):
+        pair = open_pair(path1, path2, delta_TS, ranges, align)
+    if pair is None:
+        return
+    dat1, dat2, table1, frames1, lower2, upper2, weight2 = pair
+
+    # only frames with a match in file 2:
+    matched = lower2 >= 0
+    frames1, lower2, upper2, weight2 = frames1[matched], lower2[matched], upper2[matched], weight2[matched]
+    timesteps = dat1.timesteps[frames1]
+
+    # isotope = (Z, N, name, abundance)
+    Z = np.array([isotope[0] for isotope in list_of_isotopes])
+    N = np.array([isotope[1] for isotope in list_of_isotopes])
+    names = np.array([isotope[2]+str(isotope[0]+isotope[1]) for isotope in list_of_isotopes])
+
+    # (frames, isotopes) values of both files:
+    with perfstats.stage('gather'):
+        values1 = dat1.read_cells(frames1, Z, N)
+        values2 = dat2.read_cells(lower2, Z, N)
+        if np.any(weight2 > 0):
+            # interpolated in log10 abundance:
+            values2 = (1 - weight2[:, None])*values2 + weight2[:, None]*dat2.read_cells(upper2, Z, N)
+        deviation = values2 - values1
+    perfstats.count('frames', len(frames1))
+
+    with open(os.path.join(path_out, 'isotopes_deviation.npz'), 'wb') as f:
+        np.savez(f, isotopes=names, Z=Z, N=N, timesteps=timesteps, values1=values1, values2=values2, deviation=deviation)
+
+    if len(frames1) == 0:
+        print("Error: No matching frames.")
+        return
 
-                max_diff = max(max_diff, current_max)
-                min_diff = min(min_diff, current_min)
+    # time of the maximum deviation of every isotope:
+    if table1 is None:
+        table1 = frametable.FrameTable.load(dat1.path)
+    times = table1.columns['time'][frames1] if table1 is not None and 'time' in table1.columns else np.full(len(frames1), np.nan)
+    worst = np.argmax(np.abs(deviation), axis=0)
+    isotopes = np.arange(len(names))
+    max_deviation = deviation[worst, isotopes]
+    mean_abs = np.abs(deviation).mean(axis=0)
 
-                # only plot if diff exceeds threshold in either direction:
-                if current_max < threshold and current_min > -threshold:
-                    break
-                
-                # plot using data_y_2d_diff with fire color scale
-                plt.pcolormesh(A, Z, data_y_2d_diff, vmin=-output_range, vmax=output_range, cmap='seismic') #RdBu
+    # overall ranking, most divergent first:
+    with open(os.path.join(path_out, 'isotopes_summary.csv'), 'w') as f:
+        f.write('rank,isotope,Z,N,max_deviation,timestep_max,time_max,mean_abs,final_deviation\n')
+        for rank, i in enumerate(np.argsort(-np.abs(max_deviation), kind='stable')):
+            f.write('%d,%s,%d,%d,%.6g,%d,%.6g,%.6g,%.6g\n' % (rank+1, names[i], Z[i], N[i], max_deviation[i], timesteps[worst[i]], times[worst[i]], mean_abs[i], deviation[-1, i]))
 
-                # add scale, set axis labels:
-                plt.colorbar()
-                plt.xlabel("N")
-                plt.ylabel("Z")
+    # top_k isotopes of every frame:
+    k = min(top_k, len(names))
+    top = np.argsort(-np.abs(deviation), axis=1, kind='stable')[:, :k]
+    with open(os.path.join(path_out, 'isotopes_topk.csv'), 'w') as f:
+        f.write('timestep,rank,isotope,Z,N,deviation\n')
+        for row in range(len(frames1)):
+            for rank, i in enumerate(top[row]):
+                f.write('%d,%d,%s,%d,%d,%.6g\n' % (timesteps[row], rank+1, names[i], Z[i], N[i], deviation[row, i]))
 
-                # save plot, write timestep padded with zeroes:
-                save_name = path_out+'/diff_'+str(timestep1).zfill(5)+'.png'
+    print("Isotopes: most divergent",', '.join(names[np.argsort(-np.abs(max_deviation), kind='stable')[:k]]),"- tables written to",path_out)
 
-                # draw a rectangle around the reference isotopes: PROBLEM
-                for isotope in list_of_isotopes:
-                    # isotope = (Z, N, name, abundance)
-                    isoZ = isotope[0]
-                    isoN = isotope[1]
-                    plt.gca().add_patch(plt.Rectangle((isoN-0.5, isoZ-0.5), 1, 1, fill=False, facecolor='none', edgecolor='gray', lw=0.15))
 
-                # draw lines at shell closures:
-                for magic_number in magic_numbers_protons:
-                    plt.axhline(y=magic_number-0.5, color='gray', lw=0.15)
-                for magic_number in magic_numbers_neutrons:
-                    plt.axvline(x=magic_number-0.5, color='gray', lw=0.15)
+# baseline of CompareRuns (DatFile, FrameTable), opened once per process:
+_baseline = None
 
-                # add timestamp to plot (aligned to left side, top)
-                plt.text(0.01, 0.99, "timestep: "+str(timestep1)+"\nmax diff: "+str(round(max_diff, 4))+"\nmin diff: "+str(round(min_diff, 4)), horizontalalignment='left', verticalalignment='top', transform=plt.gca().transAxes)
 
-                # print("Saving",save_name)
-                plt.savefig(save_name, dpi=280)
-                plt.clf()
+def _open_baseline(path):
+    global _baseline
+    _baseline = (datfile.DatFile(path), frametable.FrameTable.load(path))
 
-                rendered_entries += 1
 
-                # break inner loop:
-                break
+def _compare_run(task):
+    # screen (and optionally render) one run against the baseline, returns (path, stats, passed) or (path, None, None)
+    path2, frames1, settings = task
+    dat1, table1 = _baseline
+    try:
+        dat2 = datfile.DatFile(path2)
+    except (OSError, ValueError):
+        print("Error: Could not open run:",path2)
+        return path2, None, None
+
+    table2 = None
+    if settings['align'] != 'timestep':
+        table2 = frametable.FrameTable.load(path2)
+        if table2 is None:
+            print("Error: No metadata sidecar for run",path2,"- convert it again to align frames by time.")
+            return path2, None, None
+
+    box = compare_box(dat1, dat2, settings['DIM_N_limit'], settings['DIM_Z_limit'])
+    if box is None:
+        print("Error: No data of run",path2,"below the N/Z limits!")
+        return path2, None, None
+
+    lower2, upper2, weight2 = match_frames(dat1, dat2, frames1, settings['delta_TS'], settings['align'], table1, table2)
+    stats = screen_frames(dat1, dat2, frames1, lower2, upper2, weight2, box)
+    passed = (stats['max'] >= settings['threshold']) | (stats['min'] <= -settings['threshold'])
+
+    # diff frames of this run go to a subdirectory named after the run:
+    if settings['render'] and np.any(passed):
+        path_out = os.path.join(settings['path_out'], os.path.splitext(os.path.basename(path2))[0])
+        if not os.path.exists(path_out):
+            os.makedirs(path_out)
+        run_max, run_min = run_extremes(stats)
+        render_diff_frames(dat1, dat2, frames1, lower2, upper2, weight2, box, stats, np.flatnonzero(passed), path_out, settings['output_range'], settings['list_of_isotopes'], run_max, run_min, settings['backend'], 1, settings['video'], settings['png'], settings['fps'])
+
+    return path2, stats, passed
+
+
+def write_runs_report(path_out, runs, timesteps, results):
+    # run x timestep matrices of every statistic (NaN where a run has no matching frame) in runs_report.npz,
+    # one summary line per run in runs_summary.csv
+    matrices = {name: np.full((len(runs), len(timesteps)), np.nan) for name in STAT_COLUMNS}
+    passed = np.zeros((len(runs), len(timesteps)), dtype=bool)
+    for row, (run, stats, run_passed) in enumerate(results):
+        if stats is None:
+            continue
+        for name in STAT_COLUMNS:
+            matrices[name][row] = stats[name]
+        passed[row] = run_passed
+
+    with open(os.path.join(path_out, 'runs_report.npz'), 'wb') as f:
+        np.savez(f, runs=np.array(runs), timesteps=timesteps, passed=passed, **matrices)
+
+    with open(os.path.join(path_out, 'runs_summary.csv'), 'w') as f:
+        f.write('run,matched,passed,min,max,mean_abs_max,rms_max,timestep_rms_max\n')
+        for row, run in enumerate(runs):
+            matched = ~np.isnan(matrices['rms'][row])
+            if not np.any(matched):
+                f.write('%s,0,0,nan,nan,nan,nan,-1\n' % run)
+                continue
+            worst = np.nanargmax(matrices['rms'][row])
+            f.write('%s,%d,%d,%.6g,%.6g,%.6g,%.6g,%d\n' % (run, np.count_nonzero(matched), np.count_nonzero(passed[row]), np.nanmin(matrices['min'][row]),
+                    np.nanmax(matrices['max'][row]), np.nanmax(matrices['mean_abs'][row]), matrices['rms'][row][worst], timesteps[worst]))
 
-        # progress output, rounded to seconds
-        time_elapsed_time = time.time() - start_time
-        time_elapsed_string = "(elapsed: "+str(round(time.time() - start_time, 0))+"s"
 
-        # total without unrendered entries:
-        total_render_count = len(data1) - (i - rendered_entries)
+def CompareRuns(baseline, runs, reference_isotopes, path_out, delta_TS, output_range, threshold, DIM_N_limit, DIM_Z_limit, ranges=None, align='timestep', render=True, jobs=1, backend='matplotlib', video=None, png=True, fps=framerender.VIDEO_FPS):
+    # compare many runs against one baseline: the baseline is opened once (per worker process), every run is
+    # aligned and screened against it like in CompareTimeSeries. Runs are processed by a pool of jobs processes.
+    list_of_isotopes = load_reference_isotopes(reference_isotopes)
 
-        time_remaining_string = ""
-        if rendered_entries > 20:
-            time_remaining_time = ((total_render_count/rendered_entries)-1)*time_elapsed_time
-            time_remaining_string = ", remaining: "+str(round(time_remaining_time, 0))+"s"
+    if not os.path.exists(path_out):
+        os.makedirs(path_out)
 
-        print("Progress: ",i+1,"/",len(data1),time_elapsed_string,time_remaining_string,")      Currend diff.= (",current_min,",",current_max,")                ",end='\r', flush=True)
+    try:
+        _open_baseline(baseline)
+    except (OSError, ValueError):
+        print("Error: Could not open baseline:",baseline)
+        return
+    dat1, table1 = _baseline
 
-    # close files:
-    f1.close()
-    f2.close()
+    if (ranges or align != 'timestep') and table1 is None:
+        print("Error: No metadata sidecar for the baseline - convert it again to select or align frames by header values.")
+        return
 
-    print("Done.         ")
+    # frames of the baseline to compare, optionally selected by header values:
+    frames1 = np.arange(len(dat1))
+    if ranges:
+        frames1 = table1.select_ranges(ranges)
+    print("Baseline:",len(frames1),"timesteps, comparing",len(runs),"runs (",align,"alignment ).")
 
+    import time
+    start_time = time.time()
 
-# main: read arguments and call function
-if __name__ == "__main__":
-    # read arguments:
-    import argparse
-    parser = argparse.ArgumentParser(description='Compare two time series files.')
-    parser.add_argument('path1', metavar='path1', type=str, nargs=1, help='path to first file')
+    settings = {'delta_TS': delta_TS, 'align': align, 'threshold': threshold, 'DIM_N_limit': DIM_N_limit, 'DIM_Z_limit': DIM_Z_limit,
+                'render': render, 'path_out': path_out, 'output_range': output_range, 'list_of_isotopes': list_of_isotopes, 'backend': backend,
+                'video': video, 'png': png, 'fps': fps}
+    tasks = [(run, frames1, settings) for run in runs]
+
+    results = []
+    if jobs > 1:
+        import concurrent.futures
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_open_baseline, initargs=(baseline,)) as executor:
+            for result in executor.map(_compare_run, tasks):
+                results.append(result)
+                print("Runs: ",len(results),"/",len(runs),"(elapsed:",round(time.time() - start_time, 0),"s)                ",end='\r', flush=True)
+    else:
+        for task in tasks:
+            results.append(_compare_run(task))
+            print("Runs: ",len(results),"/",len(runs),"(elapsed:",round(time.time() - start_time, 0),"s)                ",end='\r', flush=True)
+
+    with perfstats.stage('report'):
+        write_runs_report(path_out, runs, dat1.timesteps[frames1], results)
+    print("Done, report written to",os.path.join(path_out, 'runs_report.npz'),"and runs_summary.csv.                ")
+
+
+def add_arguments(parser):
+    # command line options (this script and "prism.py diff")
+    parser.add_argument('path1', metavar='path1', type=str, nargs=1, help='path to first file (the baseline with --runs)')
     parser.add_argument('path2', metavar='path2', type=str, nargs=1, help='path to second file')
     parser.add_argument('reference_isotopes', metavar='reference_isotopes', type=str, nargs=1, help='path to reference_isotopes file')
     parser.add_argument('output_paths', metavar='output_paths', type=str, nargs=1, help='path to output directory')
-    parser.add_argument('delta_TS', metavar='delta_TS', type=float, nargs=1, help='temporal offset between files')
+    parser.add_argument('delta_TS', metavar='delta_TS', type=float, nargs=1, help='temporal offset between files (timesteps, seconds for --align nearest/linear)')
     parser.add_argument('output_range', metavar='output_range', type=float, nargs=1, help='output range')
     parser.add_argument('threshold', metavar='threshold', type=float, nargs=1, help='deviation needs to exceed threshold to be plotted')
     parser.add_argument('DIM_Z_limit', metavar='DIM_Z_limit', type=int, nargs=1, help='limit for DIM_Z')
     parser.add_argument('DIM_N_limit', metavar='DIM_N_limit', type=int, nargs=1, help='limit for DIM_N')
-    args = parser.parse_args()
+    parser.add_argument('--report-only', action='store_true', help='only write the screening report (diff_report.csv), render nothing')
+    parser.add_argument('--align', choices=ALIGN_MODES, default='timestep', help='match frames by timestep or by physical time (nearest frame or linear interpolation)')
+    parser.add_argument('--runs', type=str, nargs='+', default=None, help='more runs: path2 and these are all compared against path1 (one subdirectory of diff frames per run)')
+    parser.add_argument('--jobs', type=int, default=1, help='number of worker processes (rendering frames, or runs with --runs)')
+    parser.add_argument('--backend', choices=framerender.BACKENDS, default='matplotlib', help='matplotlib figures or the fast raster output (no axes)')
+    parser.add_argument('--isotopes', action='store_true', help='per-isotope deviation tables of the reference isotopes instead of diff frames')
+    parser.add_argument('--top-k', type=int, default=10, help='number of most divergent isotopes listed per frame (with --isotopes)')
+    parser.add_argument('--video', type=str, default=None, help='stream the diff frames into an animation of this format (e.g. mp4 or gif), written to the output directory as diff.<format>')
+    parser.add_argument('--fps', type=int, default=framerender.VIDEO_FPS, help='frame rate of the animation (with --video)')
+    parser.add_argument('--no-png', action='store_true', help='do not write PNG frames (with --video)')
+    frametable.add_range_arguments(parser)
+    perfstats.add_arguments(parser)
+
+
+def main(args):
+    if args.no_png and args.video is None:
+        print("Error: --no-png needs --video")
+        sys.exit(2)
+
+    with perfstats.session('plot2D_diff', args):
+        if args.isotopes:
+            CompareIsotopes(args.path1[0], args.path2[0], args.reference_isotopes[0], args.output_paths[0], args.delta_TS[0], frametable.ranges_from_args(args), args.align, args.top_k)
+        elif args.runs:
+            CompareRuns(args.path1[0], args.path2 + args.runs, args.reference_isotopes[0], args.output_paths[0], args.delta_TS[0], args.output_range[0], args.threshold[0], args.DIM_N_limit[0], args.DIM_Z_limit[0], frametable.ranges_from_args(args), args.align, not args.report_only, args.jobs, args.backend, args.video, not args.no_png, args.fps)
+        else:
+            CompareTimeSeries(args.path1[0], args.path2[0], args.reference_isotopes[0], args.output_paths[0], args.delta_TS[0], args.output_range[0], args.threshold[0], args.DIM_N_limit[0], args.DIM_Z_limit[0], frametable.ranges_from_args(args), args.align, not args.report_only, args.backend, args.jobs, args.video, not args.no_png, args.fps)
+
 
-    # call function:
-    CompareTimeSeries(args.path1[0], args.path2[0], args.reference_isotopes[0], args.output_paths[0], args.delta_TS[0], args.output_range[0], args.threshold[0], args.DIM_N_limit[0], args.DIM_Z_limit[0])
+# main: read arguments and call function
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Compare two time series files.')
+    add_arguments(parser)
+    main(parser.parse_args())
@@ -1,185 +1,161 @@
-import matplotlib.pyplot as plt
-import numpy as np
 import os
+import sys
 
-# define nuclide chart grid dimensions that we want to compare:
-DIM_N = 120
-DIM_Z = 120
+import buildcache
+import datfile
+import frametable
+import perfstats
+import xtime
 
 path_time_series = 'time2D_bin/'
 
-def OpenTimeSeries(path):
-    # Get raw input path (without extension):
-    file_name_raw = path[:-4]
+
+def convert_params(sparse):
+    # everything that changes the output, files are converted again if one of these changes
+    return {'extent': 'data', 'sparse': sparse, 'format': datfile.VERSION}
+
+
+def OpenTimeSeries(path, jobs=1, sparse=False, manifest=None, output_dir=None):
+    # Get raw input name (without folder and extension), the .dat file goes to output_dir (time2D_bin/ next to the
+    # input by default):
+    file_name_raw = os.path.basename(path)[:-4]
+    if output_dir is None:
+        output_dir = os.path.join(os.path.dirname(path), path_time_series)
+    dat_path = os.path.join(output_dir, file_name_raw+'.dat')
+
+    # incremental: skip the file if it was converted with the same parameters and did not change since
+    if manifest is not None and manifest.is_current(path, convert_params(sparse)):
+        print("Converting",file_name_raw,"to binary: Up to date.        ")
+        return
     print("Converting",file_name_raw,"to binary: Starting...        ", end="\r", flush=True)
 
-    # Data format example (blocks continue like this but with different amount of data points):
-    # timestep      3   time(s)  0.184731E-01   temperature(GK) 0.100000E+02   density(g/cm^3) 0.531701E+08   radius(arb.units) 0.100000E+09
-    # 0     1    0.899782E+00
-    # 1     1    0.997817E-01
-    # 1     2    0.436210E-03
-    # 1     3    0.479214E-06
-    # 2     3    0.220333E-07
-    # 2     4    0.181096E-09
-
-    # open output binary file and keep reference to file, which will later be written to:
-    f_out = open(path_time_series+file_name_raw+'.dat', 'wb')
-
-    # write header to output file (dimensions):
-    f_out.write(DIM_N.to_bytes(4, byteorder='little', signed=True))
-    f_out.write(DIM_Z.to_bytes(4, byteorder='little', signed=True))
-
-    # Create mesh grid with dimensions DIM_N x DIM_Z
-    A, Z = np.meshgrid(range(DIM_N), range(DIM_Z))
-
-    DEBUG_CACHE = []
-
-    # we need to iterate line by line and extract the third column of every block that starts with 'timestep':
-    current_index = -1
-    with open(path) as f:
-        data_list = [] # structured data, N,Z,abundance 
-        # loop over lines:
-        for line in f:
-            if line.startswith('timestep'): # if line starts with 'timestep', it's metadata otherwise it's data, if metadata: first column is "timestep", second column is current_index (to be extracted)
-                # if current index is set, plot data_list, reset it and continue
-                if current_index > -1:
-                    print("Converting",file_name_raw,"to binary: Time step:",current_index,"        ", end="\r", flush=True)
-
-                    # Create a 2D array to hold the y data
-                    data_y_2d = np.full(A.shape, -15.0)  # Initialize with 0
-
-                    for data_point in data_list:
-                        if data_point[0] < DIM_N and data_point[1] < DIM_Z: # range sanity check
-                            data_y_2d[data_point[1], data_point[0]] = np.log10( data_point[2] )
-                            # print("DEBUG: Appending data point",data_point[0],data_point[1],data_point[2])
-
-                    # print("DEBUG: Appending data for timestep",current_index)
-                    # # also print data:
-                    # for i in range(10):
-                    #     for j in range(10):
-                    #         print(data_y_2d[i,j], end=" ", flush=True)
-                    #     print("")
-
-                    # print("DEBUG: Range:")
-                    # print("DEBUG: min:",np.amin(data_y_2d))
-                    # print("DEBUG: max:",np.amax(data_y_2d))
-
-                    # print("DEBUG: -")
-                    DEBUG_CACHE.append(data_y_2d)
-
-                    # Now plot using data_y_2d with fire color scale
-                    #plt.pcolormesh(A, Z, data_y_2d, vmin=-15, vmax=0, cmap='hot')
-
-                    # Write current mesh in binary format, format, assuming DIM_N=150, DIM_Z=150:
-                    # first write timestep as int32, then write data_y_2d as float32
-                    f_out.write(current_index.to_bytes(4, byteorder='little', signed=True))
-                    f_out.write(data_y_2d.astype(np.float32).tobytes())
-
-                    # reset data_list:
-                    data_list = []
-
-                # extract current_index:
-                current_index = int(line.split()[1])
-            else:
-                # only continue if current_index is set:
-                if current_index > -1:
-                    # extract data:
-                    extract = line.split()
-                    if len(extract) > 2:
-                        data_Z = int(extract[0]) # Z
-                        data_A = int(extract[1]) # A
-                        data_y = float(extract[2]) # abundance
-
-                        # log scale (with sanity check)
-                        # if data_y > 0:
-                        #     data_y = np.log10(data_y)
-                        # else:
-                        #     data_y = -15
-
-                        # append to data_list:
-                        data_list.append( (data_A - data_Z, data_Z, data_y) )
-
-
-    # DEBUG test: read back data and compare:
-    f_out.close()
-
-    # # re-open file:
-    # f_out = open(path_time_series+file_name_raw+'.dat', 'rb')
-
-    # # read header:
-    # deb_DIM_N = int.from_bytes(f_out.read(4), byteorder='little', signed=True)
-    # deb_DIM_Z = int.from_bytes(f_out.read(4), byteorder='little', signed=True)
-
-    # print("DEBUG: File:",deb_DIM_N,"x",deb_DIM_Z)
-
-    # # read data:
-    # for i in range(len(DEBUG_CACHE)):
-    #     # read timestep:
-    #     try:
-    #         deb_timestep = int.from_bytes(f_out.read(4), byteorder='little', signed=True)
-    #     except:
-    #         print("DEBUG: Could not read timestep!")
-    #         return
-        
-    #     print("DEBUG: Reading timestep:",deb_timestep,"        ", end="\r", flush=True)
-
-    #     # read data:
-    #     try:
-    #         deb_data = np.frombuffer(f_out.read(deb_DIM_N*deb_DIM_Z*4), dtype=np.float32)
-    #         deb_data = deb_data.reshape((deb_DIM_N, deb_DIM_Z))
-    #     except:
-    #         print("DEBUG: Could not read data!")
-    #         return
-
-    #     # compare:
-    #     if np.array_equal(deb_data, DEBUG_CACHE[i]):
-    #         max_val = np.amax(deb_data)
-    #         min_val = np.amin(deb_data)
-    #         print("DEBUG: Time step",deb_timestep,"matches ( min:",min_val,"max:",max_val,")")
-    #     else:
-    #         print("DEBUG: Time step",deb_timestep,"does not match!")
-    #         return
-
-
-    # # close output file:
-    # f_out.close()
+    # header values (time, temperature, ...) of every frame, stored as metadata sidecar next to the .dat file:
+    headers = []
+
+    # parse 'timestep' blocks into (Z, N, log10 abundance) columns, either one block at a time or with a process pool
+    # working on byte ranges of the file (blocks still arrive in file order):
+    if jobs > 1:
+        blocks = xtime.iter_columns_parallel(path, jobs)
+    else:
+        blocks = xtime.iter_columns(path)
+
+    # first pass: spool the parsed blocks and find the (N, Z) extent of the data
+    spool = xtime.ColumnSpool()
+    extent = None
+    for current_index, header, Z, N, values in perfstats.timed('parse', blocks):
+        print("Converting",file_name_raw,"to binary: Parsing time step:",current_index,"        ", end="\r", flush=True)
+        headers.append(header)
+        extent = xtime.merge_extent(extent, xtime.block_extent(Z, N))
+        with perfstats.stage('spool'):
+            spool.append(current_index, Z, N, values)
+
+    # the grid covers exactly the populated region, nothing is clipped:
+    origin_N, origin_Z, DIM_N, DIM_Z = xtime.grid_extent(extent)
+
+    # open output binary file (format version 2, see datfile.py), frames are written to it one by one. In sparse mode
+    # only the populated cells of every frame are stored:
+    metadata = {'source': os.path.basename(path), 'values': 'log10(abundance)', 'fill_value': xtime.FILL_VALUE}
+    f_out = datfile.DatWriter(dat_path, DIM_N, DIM_Z, metadata, sparse=sparse, fill_value=xtime.FILL_VALUE, origin_N=origin_N, origin_Z=origin_Z)
+
+    # second pass: rasterize and write the spooled blocks
+    for current_index, Z, N, values in perfstats.timed('spool', spool):
+        print("Converting",file_name_raw,"to binary: Time step:",current_index,"        ", end="\r", flush=True)
+
+        # Write current mesh in binary format (timestep + DIM_Z x DIM_N grid as float32):
+        with perfstats.stage('rasterize'):
+            grid = xtime.rasterize_cells(Z, N, values, DIM_N, DIM_Z, origin_N, origin_Z)
+        with perfstats.stage('write'):
+            f_out.write_frame(current_index, grid)
+        perfstats.count('frames')
+
+    spool.close()
+
+    # close output file (writes frame directory and header):
+    with perfstats.stage('write'):
+        f_out.close()
+
+    # write metadata sidecar (XTime.meta.npz):
+    with perfstats.stage('metadata'):
+        frametable.FrameTable.from_headers(headers).save(dat_path)
+    perfstats.count_file('bytes_in', path)
+    perfstats.count_file('bytes_out', dat_path)
+
+    if manifest is not None:
+        manifest.record(path, convert_params(sparse), [dat_path, frametable.sidecar_path(dat_path)])
+
     print("Converting",file_name_raw,"to binary: Completed.        ")
 
 
-def plot_dir_contents(input_folder, output_path):
-    #### load all files in the directory and plot x-y
-    # get list of output_dir contents:
-    os.chdir(input_folder)
+def _convert_task(task):
+    # worker (buildcache.run_batch): convert one file, returns its manifest entry
+    path, jobs, sparse, output_dir, force = task
+    manifest = None if force else buildcache.Manifest(output_dir)
+    print("Loading time series from file:",path)
+    OpenTimeSeries(path, jobs, sparse, manifest, output_dir)
+    return None if manifest is None else manifest.entry(path)
+
+
+def plot_dir_contents(input_folder, output_path, jobs=1, sparse=False, force=False, file_jobs=1):
+    #### load all files in the directory and convert them, the .dat files go to input_folder/time2D_bin/.
+    # With file_jobs > 1 a pool of processes converts that many files at once (jobs workers each), largest file first.
+    # Returns the files that failed, the others are converted anyway.
 
     # get list of input files:
-    files = os.listdir()
+    files = os.listdir(input_folder)
 
     print(files)
 
     # if it does not exist yet, create subfolder "time":
-    if not os.path.exists(path_time_series):
-        os.makedirs(path_time_series)
-
-    # loop over txt files:
-    for file in files:
-        if file.endswith('.txt'):
-            # if path contains "XTime", we need a more sophisticated way to load the data:
-            if 'Time' in file:
-                print("Loading time series from file:",file)
-                OpenTimeSeries(file)
-
-# main method, read input_folder, output_path and delay from command line arguments
-if __name__ == '__main__':
-    import sys
-    if not (len(sys.argv) in [3]):
-        print('Usage: python to_binary.py <input_folder> <output_path>')
+    output_dir = os.path.join(input_folder, path_time_series)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # rebuild manifest: unchanged files are skipped (unless force is set)
+    manifest = None if force else buildcache.Manifest(output_dir)
+
+    # txt files with "XTime" in the name, we need a more sophisticated way to load the data:
+    paths = buildcache.largest_first([os.path.join(input_folder, file) for file in files if file.endswith('.txt') and 'Time' in file])
+    tasks = [(path, jobs, sparse, output_dir, force) for path in paths]
+
+    failed = []
+    for task, entry, output, error in buildcache.run_batch(_convert_task, tasks, file_jobs):
+        if output:
+            print(output)
+        if error is not None:
+            print("Error: Converting",task[0],"failed:",error)
+            failed.append(task[0])
+            continue
+
+        # save after every file, so an interrupted run keeps its progress:
+        if manifest is not None:
+            manifest.merge(task[0], entry)
+            manifest.save()
+
+    if failed:
+        print("Failed:",len(failed),"of",len(tasks),"files:",', '.join(failed))
+    return failed
+
+def add_arguments(parser):
+    # command line options (this script and "prism.py convert")
+    parser.add_argument('input_folder', type=str, help='The folder containing the XTime text files.')
+    parser.add_argument('output_path', type=str, help='Not used, the .dat files are written to <input_folder>/'+path_time_series+'.')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of worker processes used to convert a single file.')
+    parser.add_argument('--sparse', action='store_true', help='Store only the populated cells of every frame.')
+    parser.add_argument('--force', action='store_true', help='Convert all files, even if the outputs are up to date.')
+    parser.add_argument('--file-jobs', type=int, default=1, help='Number of files converted at once (worker processes, largest file first).')
+    perfstats.add_arguments(parser)
+
+
+def main(args):
+    with perfstats.session('plot2D_to_binary', args):
+        failed = plot_dir_contents(args.input_folder, args.output_path, args.jobs, args.sparse, args.force, args.file_jobs)
+    if failed:
         sys.exit(1)
 
-    # read arguments:
-    import argparse
-    parser = argparse.ArgumentParser(description='Create a gif from a folder of png files.')
-    parser.add_argument('input_folder', type=str, help='The folder containing the png files.')
-    parser.add_argument('output_path', type=str, help='The path to the output gif file.')
-    args = parser.parse_args()
 
-    plot_dir_contents(args.input_folder, args.output_path)
+# main method, read input_folder and options from command line arguments
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Convert the XTime text files of a folder to binary time series (.dat).')
+    add_arguments(parser)
+    main(parser.parse_args())
@@ -0,0 +1,47 @@
+import argparse
+import importlib
+import sys
+
+# Single entry point for all tools: python prism.py <command> ...
+#
+#   convert   XTime text files -> binary time series (plot2D_to_binary.py)
+#   plot      nuclide charts of text files and time series (plot2D.py)
+#   diff      compare two or more time series (plot2D_diff.py)
+#   animate   folder of frames -> GIF or video (make_anim.py)
+#   query     grid, frames and header values of time series (query.py)
+#   follow    convert and render running simulations as they write (follow.py)
+#
+# Only the module of the chosen command is imported (and it imports matplotlib, imageio or cv2 only where it needs
+# them), so short jobs like convert and query start without loading any plotting libraries. The scripts still work
+# on their own with the same options.
+
+COMMANDS = {
+    'convert': ('plot2D_to_binary', 'Convert the XTime text files of a folder to binary time series (.dat).'),
+    'plot': ('plot2D', 'Plot the text files and time series of a folder as nuclide charts.'),
+    'diff': ('plot2D_diff', 'Compare two time series files.'),
+    'animate': ('make_anim', 'Create a gif or video from a folder of png files.'),
+    'query': ('query', 'Print the grid, frames and header values of time series files.'),
+    'follow': ('follow', 'Follow the XTime files of running simulations: convert and render new timesteps as they are written.'),
+}
+
+
+def build_parser(command=None):
+    # parser with all commands, only the options of command are added (its module is imported for that)
+    parser = argparse.ArgumentParser(prog='prism.py', description='PRISM visualization tools.')
+    subparsers = parser.add_subparsers(dest='command', metavar='command', required=True)
+    for name, (module, description) in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=description, description=description)
+        if name == command:
+            importlib.import_module(module).add_arguments(subparser)
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if argv and argv[0] in COMMANDS else None
+    args = build_parser(command).parse_args(argv)
+    importlib.import_module(COMMANDS[args.command][0]).main(args)
+
+
+if __name__ == '__main__':
+    main()
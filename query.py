@@ -0,0 +1,112 @@
+import os
+import sys
+import numpy as np
+
+import datfile
+import frametable
+import xtime
+
+# Answers questions about converted (.dat) and text (XTime) time series without plotting anything: grid, number of
+# frames and the header values of the frames, optionally only the frames in given ranges or the frame nearest to a
+# value, and the values of single isotope cells (Z, N) in those frames (.dat files). Everything comes from the
+# metadata sidecar (.meta.npz) or the byte-offset index of the text file, only --cell reads frame data.
+#
+# --repair makes partially written .dat files (e.g. an interrupted conversion) consistent again before they are
+# queried: the complete frames are kept, the rest is dropped and a new frame directory is written.
+
+
+def describe(path):
+    # (summary line, frame table or None, DatFile or None) of a .dat or text file
+    if path.endswith('.dat'):
+        dat = datfile.DatFile(path)
+        summary = "format "+str(dat.version)+(", sparse" if dat.sparse else "")+", "+str(len(dat))+" frames, grid N "+str(dat.origin_N)+".."+str(dat.origin_N+dat.DIM_N-1)+", Z "+str(dat.origin_Z)+".."+str(dat.origin_Z+dat.DIM_Z-1)
+        return summary, frametable.FrameTable.load(path), dat
+
+    index = xtime.open_index(path)
+    summary = "text, "+str(len(index))+" frames"
+    if index.extent is not None:
+        N_min, N_max, Z_min, Z_max = index.extent
+        summary += ", data N "+str(N_min)+".."+str(N_max)+", Z "+str(Z_min)+".."+str(Z_max)
+    return summary, index.table, None
+
+
+def RepairFile(path):
+    # keep the complete frames of a .dat file and write a new directory (datfile.recover), rows of the metadata
+    # sidecar beyond the recovered frames are dropped as well
+    count = datfile.recover(path)
+    table = frametable.FrameTable.load(path)
+    if table is not None and len(table) > count:
+        frametable.FrameTable({name: values[:count] for name, values in table.columns.items()}).save(path)
+    print("Repaired",path+":",count,"frames")
+
+
+def QueryFile(path, ranges=None, nearest=None, cells=None, list_frames=False):
+    # print the summary of a file and the header values (and cell values) of the selected frames: the frames in the
+    # ranges ({name: (low, high)}), the frame nearest to nearest = (name, value), or all frames with list_frames
+    summary, table, dat = describe(path)
+    print(path+":",summary)
+    if not (ranges or nearest or cells or list_frames):
+        return
+
+    if table is None:
+        print("Error: No metadata sidecar for",path,"- convert it again to query frames.")
+        return
+    if cells and dat is None:
+        print("Error: --cell needs a .dat file.")
+        return
+
+    frames = table.select_ranges(ranges or {})
+    if nearest is not None:
+        frames = np.array([table.nearest(nearest[0], nearest[1])])
+
+    columns = [name for name in frametable.COLUMNS if name in table.columns]
+    values = None
+    if cells:
+        Z, N = zip(*cells)
+        values = dat.read_cells(frames, Z, N)
+
+    print(','.join(['frame'] + columns + ['Z'+str(z)+'_N'+str(n) for z, n in (cells or [])]))
+    for row, frame in enumerate(frames):
+        fields = table.header(frame)
+        line = [str(frame)] + ['%d' % fields[name] if name == 'timestep' else '%.6E' % fields[name] for name in columns]
+        if values is not None:
+            line += ['%.6f' % value for value in values[row]]
+        print(','.join(line))
+
+
+def add_arguments(parser):
+    # command line options (this script and "prism.py query")
+    parser.add_argument('paths', type=str, nargs='+', help='.dat files or XTime text files.')
+    parser.add_argument('--list', action='store_true', help='List the header values of all frames.')
+    parser.add_argument('--nearest', type=str, nargs=2, metavar=('NAME', 'VALUE'), default=None, help='Only the frame whose NAME (timestep, time, temperature, density, radius) is closest to VALUE.')
+    parser.add_argument('--repair', action='store_true', help='Make partially written .dat files consistent first (complete frames are kept, the rest is dropped).')
+    parser.add_argument('--cell', type=int, nargs=2, metavar=('Z', 'N'), action='append', default=None, help='Also print the value (log10 abundance) of this isotope cell, can be given more than once (.dat files).')
+    frametable.add_range_arguments(parser)
+
+
+def main(args):
+    nearest = None
+    if args.nearest is not None:
+        if args.nearest[0] not in frametable.COLUMNS:
+            print("Error: --nearest needs one of",', '.join(frametable.COLUMNS))
+            sys.exit(2)
+        nearest = (args.nearest[0], float(args.nearest[1]))
+
+    for path in args.paths:
+        if not os.path.exists(path):
+            print("Error:",path,"does not exist.")
+            sys.exit(1)
+        if args.repair:
+            if not path.endswith('.dat'):
+                print("Error: --repair needs a .dat file.")
+                sys.exit(2)
+            RepairFile(path)
+        QueryFile(path, frametable.ranges_from_args(args), nearest, args.cell, args.list)
+
+
+# main method, read files and options from command line arguments
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Print the grid, frames and header values of time series files.')
+    add_arguments(parser)
+    main(parser.parse_args())
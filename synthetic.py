@@ -0,0 +1,128 @@
+import os
+import numpy as np
+
+import datfile
+import frametable
+import xtime
+
+# Synthetic PRISM-like workloads for benchmarks (see benchmark.py), deterministic for a given seed.
+#
+# Every run is an XTime text file with the usual layout: a 'timestep' header line (time, temperature, density,
+# radius), then one "Z A abundance" line per isotope. The isotopes are a fixed set of cells in a band around the
+# valley of stability, their abundances follow a peak that moves to heavier nuclei over the run. Run 0 is the
+# baseline, the other runs deviate from it by a smooth pattern (perturbation, in log10 abundance) that is shifted for
+# every run, so no two runs are the same. Matching .dat files (and metadata sidecars) are written next to the text
+# files in time2D_bin/, like plot2D_to_binary.py does, and a list of reference isotopes picked from the populated
+# cells.
+
+
+def isotope_cells(isotopes, DIM_N, DIM_Z, random):
+    # (Z, N) of isotopes cells in the band N = 0.9 Z .. 1.5 Z + 5 (inside DIM_N x DIM_Z), sorted by Z and A like in
+    # PRISM output
+    Z, N = np.meshgrid(np.arange(DIM_Z), np.arange(DIM_N), indexing='ij')
+    band = (N >= 0.9*Z) & (N <= 1.5*Z + 5) & (Z + N > 0)
+    Z, N = Z[band], N[band]
+    if isotopes < len(Z):
+        chosen = np.sort(random.choice(len(Z), isotopes, replace=False))
+        Z, N = Z[chosen], N[chosen]
+    return Z, N
+
+
+def block_text(Z, N, log_abundance):
+    # body of a block, "Z A abundance" lines
+    lines = np.column_stack((Z, Z + N, 10.0**log_abundance))
+    return ''.join('%d     %d    %.6E\n' % (z, a, y) for z, a, y in lines.tolist())
+
+
+def write_run(path, Z, N, timesteps, DIM_N, seed, perturbation=0.0, dat_path=None, phase=0.0):
+    # write one run as XTime text file (and as .dat file with metadata sidecar if dat_path is given), phase shifts the
+    # perturbation pattern
+    random = np.random.RandomState(seed)
+    # per isotope offset, fixed over the run:
+    offset = random.normal(0.0, 0.5, len(Z))
+
+    writer = None
+    headers = []
+    with open(path, 'w') as f:
+        f.write("synthetic PRISM run\n")
+        for t in range(timesteps):
+            progress = t / max(timesteps - 1, 1)
+
+            # abundance peak moving from light to heavy nuclei, log10 abundance between about -25 and 0:
+            peak = (0.1 + 0.7*progress)*DIM_N
+            log_abundance = -2.0 - 20.0*((N - peak)/(0.25*DIM_N))**2 + offset + random.normal(0.0, 0.05, len(Z))
+            log_abundance += perturbation*np.sin(0.3*Z + 0.2*N + 3.0*progress + phase)
+            np.clip(log_abundance, -25.0, 0.0, out=log_abundance)
+
+            header = "timestep %6d   time(s)  %.6E   temperature(GK) %.6E   density(g/cm^3) %.6E   radius(arb.units) %.6E" % (t + 1, 0.01*(t + 1)**1.3, 10.0/(1 + 0.05*t), 5e7/(1 + t), 1e9)
+            body = block_text(Z, N, log_abundance)
+            f.write(header+"\n")
+            f.write(body)
+
+            if dat_path is not None:
+                # same values as the converter reads back from the text:
+                if writer is None:
+                    origin_N, origin_Z, DIM_N_data, DIM_Z_data = xtime.grid_extent(xtime.block_extent(Z, N))
+                    metadata = {'source': os.path.basename(path), 'values': 'log10(abundance)', 'fill_value': xtime.FILL_VALUE}
+                    writer = datfile.DatWriter(dat_path, DIM_N_data, DIM_Z_data, metadata, fill_value=xtime.FILL_VALUE, origin_N=origin_N, origin_Z=origin_Z)
+                data_Z, data_A, abundance = xtime.parse_block(body.encode())
+                writer.write_frame(t + 1, xtime.rasterize(data_Z, data_A, abundance, DIM_N_data, DIM_Z_data, origin_N, origin_Z))
+                headers.append(xtime.parse_header(header))
+
+    if writer is not None:
+        writer.close()
+        frametable.FrameTable.from_headers(headers).save(dat_path)
+
+
+def write_reference_isotopes(path, Z, N, count, random):
+    # count of the populated cells as reference isotopes file ("Z name A abundance")
+    chosen = np.sort(random.choice(len(Z), min(count, len(Z)), replace=False))
+    with open(path, 'w') as f:
+        for i in chosen:
+            f.write('%d X%d %d %.6E\n' % (Z[i], Z[i], Z[i] + N[i], 10.0**random.uniform(-10, -1)))
+
+
+def generate(output_dir, timesteps=100, isotopes=2000, DIM_N=160, DIM_Z=110, runs=2, reference=20, perturbation=0.3, seed=1, dat=True):
+    # write runs XTime files (XTime_synth_<run>.txt), their .dat files (time2D_bin/) and reference_isotopes.txt to
+    # output_dir. Returns {'text': [...], 'dat': [...], 'reference_isotopes': path}
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    if dat and not os.path.exists(os.path.join(output_dir, 'time2D_bin')):
+        os.makedirs(os.path.join(output_dir, 'time2D_bin'))
+
+    random = np.random.RandomState(seed)
+    Z, N = isotope_cells(isotopes, DIM_N, DIM_Z, random)
+
+    paths = {'text': [], 'dat': [], 'reference_isotopes': os.path.join(output_dir, 'reference_isotopes.txt')}
+    for run in range(runs):
+        path = os.path.join(output_dir, 'XTime_synth_'+str(run)+'.txt')
+        dat_path = os.path.join(output_dir, 'time2D_bin', 'XTime_synth_'+str(run)+'.dat') if dat else None
+        print("Generating",path,"        ", end="\r", flush=True)
+        # same isotope offsets and noise as run 0, the perturbation pattern differs from run to run:
+        write_run(path, Z, N, timesteps, DIM_N, seed + 1, perturbation if run > 0 else 0.0, dat_path, 1.0*(run - 1))
+        paths['text'].append(path)
+        if dat:
+            paths['dat'].append(dat_path)
+
+    write_reference_isotopes(paths['reference_isotopes'], Z, N, reference, random)
+    print("Generated",runs,"runs of",timesteps,"timesteps with",len(Z),"isotopes in",output_dir,"        ")
+    return paths
+
+
+# main method, read output folder and workload size from command line arguments
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Write synthetic XTime files, matching .dat files and a reference isotopes list.')
+    parser.add_argument('output_dir', type=str, help='Folder for the generated files.')
+    parser.add_argument('--timesteps', type=int, default=100, help='Number of timesteps (blocks) per run.')
+    parser.add_argument('--isotopes', type=int, default=2000, help='Number of isotopes per block.')
+    parser.add_argument('--DIM_N', type=int, default=160, help='Grid extent in N.')
+    parser.add_argument('--DIM_Z', type=int, default=110, help='Grid extent in Z.')
+    parser.add_argument('--runs', type=int, default=2, help='Number of runs (run 0 is the baseline, the others deviate from it).')
+    parser.add_argument('--reference', type=int, default=20, help='Number of reference isotopes.')
+    parser.add_argument('--perturbation', type=float, default=0.3, help='Deviation of the other runs from run 0 (log10 abundance).')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed.')
+    parser.add_argument('--no-dat', action='store_true', help='Only write the text files.')
+    args = parser.parse_args()
+
+    generate(args.output_dir, args.timesteps, args.isotopes, args.DIM_N, args.DIM_Z, args.runs, args.reference, args.perturbation, args.seed, not args.no_dat)
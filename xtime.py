@@ -0,0 +1,494 @@
+import os
+import re
+import tempfile
+import warnings
+import numpy as np
+
+import frametable
+
+# Shared reader for the PRISM XTime text format used by plot.py, plot2D.py and plot2D_to_binary.py.
+#
+# Data format example (blocks continue like this but with different amount of data points):
+# timestep      3   time(s)  0.184731E-01   temperature(GK) 0.100000E+02   density(g/cm^3) 0.531701E+08   radius(arb.units) 0.100000E+09
+# 0     1    0.899782E+00
+# 1     1    0.997817E-01
+# 1     2    0.436210E-03
+# 1     3    0.479214E-06
+# 2     3    0.220333E-07
+# 2     4    0.181096E-09
+#
+# Data lines are Z, A, abundance. Instead of splitting every line in Python, the file is read in large chunks,
+# block boundaries are found with a single regex scan and each block is converted with one NumPy call.
+
+# value for empty cells and non-positive abundances (log10 scale):
+FILL_VALUE = -15.0
+
+# amount of bytes read from disk at once:
+CHUNK_SIZE = 64 * 1024 * 1024
+
+_TIMESTEP_PATTERN = re.compile(rb'^timestep', re.MULTILINE)
+
+
+def find_timestep_offsets(buf):
+    # byte offsets of all lines in buf that start with 'timestep':
+    return [match.start() for match in _TIMESTEP_PATTERN.finditer(buf)]
+
+
+def parse_timestep(header):
+    # first column is "timestep", second column is the index:
+    return int(header.split()[1])
+
+
+def parse_header(header):
+    # all fields of a 'timestep' header line as dict, units are dropped from the labels:
+    # {'timestep': 3, 'time': 0.0184731, 'temperature': 10.0, 'density': 53170100.0, 'radius': 100000000.0}
+    tokens = header.split()
+    fields = {'timestep': int(tokens[1])}
+    for label, value in zip(tokens[2::2], tokens[3::2]):
+        if isinstance(label, bytes):
+            label = label.decode()
+        try:
+            fields[label.split('(')[0]] = float(value)
+        except ValueError:
+            continue # e.g. Fortran exponents with three digits ("0.1-100")
+    return fields
+
+
+def _iter_block_spans(f, chunk_size):
+    # yields (buf, start, end, buf_offset) for every complete 'timestep' block of an open binary file, the block is
+    # buf[start:end] and buf_offset is the position of buf[0] in the file. A block is only yielded once the next
+    # header (or EOF) has been seen.
+    tail = b''
+    while True:
+        chunk = f.read(chunk_size)
+        buf = tail + chunk
+        buf_offset = f.tell() - len(buf)
+        offsets = find_timestep_offsets(buf)
+
+        if len(offsets) == 0:
+            # no header yet: keep only the (possibly incomplete) last line, everything before is not part of a block
+            tail = buf[buf.rfind(b'\n')+1:] if chunk else b''
+            if not chunk:
+                return
+            continue
+
+        # at EOF the last block is complete, otherwise it is kept for the next chunk:
+        if chunk:
+            ends = offsets[1:]
+        else:
+            ends = offsets[1:] + [len(buf)]
+
+        for start, end in zip(offsets, ends):
+            yield buf, start, end, buf_offset
+
+        if not chunk:
+            return
+
+        tail = buf[offsets[-1]:]
+
+
+def split_block(block):
+    # split the bytes of a block into header line and body
+    header_end = block.find(b'\n')
+    if header_end < 0:
+        return block, b''
+    return block[:header_end], block[header_end+1:]
+
+
+def read_blocks(path, chunk_size=CHUNK_SIZE):
+    # yields (header, body) byte strings for every 'timestep' block of the file, the file is read in chunks of
+    # chunk_size bytes.
+    with open(path, 'rb') as f:
+        for buf, start, end, buf_offset in _iter_block_spans(f, chunk_size):
+            yield split_block(buf[start:end])
+
+
+def read_new_blocks(path, offset=0, final=False, chunk_size=CHUNK_SIZE):
+    # complete 'timestep' blocks of a file that is still being written, starting at byte offset (start of the file or
+    # of a block). Returns a list of (header, body, end), end is the file offset after the block. A block only counts
+    # as complete once the next header has been written, the last block is left for a later call (with final, e.g.
+    # after the writer finished, it is returned as well if it ends with a newline). At least one block is read, even
+    # if it is larger than chunk_size.
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        buf = f.read(chunk_size)
+        while True:
+            starts = find_timestep_offsets(buf)
+            ends = starts[1:]
+            chunk = f.read(chunk_size) if len(ends) == 0 else b''
+            if not chunk:
+                break
+            buf += chunk
+        at_end = f.tell() >= os.fstat(f.fileno()).st_size
+
+    if final and at_end and buf.endswith(b'\n') and len(starts) > 0:
+        ends = starts[1:] + [len(buf)]
+
+    return [split_block(buf[start:end]) + (offset + end,) for start, end in zip(starts, ends)]
+
+
+def _parse_block_by_line(body):
+    # slow path for blocks with irregular lines (same rules as the original line by line loop)
+    rows = []
+    for line in body.split(b'\n'):
+        extract = line.split()
+        if len(extract) > 2:
+            rows.append( (int(extract[0]), int(extract[1]), float(extract[2])) )
+
+    if len(rows) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    Z, A, abundance = zip(*rows)
+    return np.array(Z, dtype=np.int64), np.array(A, dtype=np.int64), np.array(abundance, dtype=np.float64)
+
+
+def parse_block(body):
+    # convert the numeric columns of a block with a single call, returns arrays Z, A, abundance
+    line_count = body.count(b'\n')
+    if len(body) > 0 and not body.endswith(b'\n'):
+        line_count += 1
+
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', DeprecationWarning)
+            values = np.fromstring(body, dtype=np.float64, sep=' ')
+    except (ValueError, DeprecationWarning):
+        return _parse_block_by_line(body)
+
+    # every line needs to be exactly "Z A abundance", otherwise fall back to the line by line parser:
+    if values.size != 3*line_count:
+        return _parse_block_by_line(body)
+
+    values = values.reshape(-1, 3)
+    return values[:, 0].astype(np.int64), values[:, 1].astype(np.int64), values[:, 2]
+
+
+def log_abundance(abundance):
+    # log scale (with sanity check): non-positive values are mapped to FILL_VALUE
+    result = np.full(abundance.shape, FILL_VALUE)
+    positive = abundance > 0
+    result[positive] = np.log10(abundance[positive])
+    return result
+
+
+def rasterize_cells(Z, N, values, DIM_N, DIM_Z, origin_N=0, origin_Z=0):
+    # fill a DIM_Z x DIM_N grid (rows: Z, columns: N) whose first cell is (origin_Z, origin_N) with values,
+    # cells without data are FILL_VALUE
+    grid = np.full((DIM_Z, DIM_N), FILL_VALUE)
+    row = Z - origin_Z
+    column = N - origin_N
+
+    # range sanity check (nothing is dropped if the grid covers the data extent, see data_extent)
+    inside = (column >= 0) & (column < DIM_N) & (row >= 0) & (row < DIM_Z)
+
+    grid[row[inside], column[inside]] = values[inside]
+    return grid
+
+
+def rasterize(Z, A, abundance, DIM_N, DIM_Z, origin_N=0, origin_Z=0):
+    # same for parsed columns: log10 abundances on the (Z, N = A - Z) grid
+    return rasterize_cells(Z, A - Z, log_abundance(abundance), DIM_N, DIM_Z, origin_N, origin_Z)
+
+
+def parse_columns(body):
+    # Z, N and log10 abundance of every isotope of a block
+    Z, A, abundance = parse_block(body)
+    return Z, A - Z, log_abundance(abundance)
+
+
+def block_extent(Z, N):
+    # (N_min, N_max, Z_min, Z_max) of a block, None if the block is empty
+    if len(Z) == 0:
+        return None
+    return (int(N.min()), int(N.max()), int(Z.min()), int(Z.max()))
+
+
+def merge_extent(extent1, extent2):
+    if extent1 is None:
+        return extent2
+    if extent2 is None:
+        return extent1
+    return (min(extent1[0], extent2[0]), max(extent1[1], extent2[1]), min(extent1[2], extent2[2]), max(extent1[3], extent2[3]))
+
+
+def grid_extent(extent):
+    # (origin_N, origin_Z, DIM_N, DIM_Z) of the smallest grid that holds the extent
+    if extent is None:
+        return 0, 0, 0, 0
+    return extent[0], extent[2], extent[1] - extent[0] + 1, extent[3] - extent[2] + 1
+
+
+def iter_timesteps(path, DIM_N, DIM_Z, chunk_size=CHUNK_SIZE, origin_N=0, origin_Z=0):
+    # lazily yields (timestep, header, grid) for every block of the file, only one chunk is kept in memory at a time
+    for header, body in read_blocks(path, chunk_size):
+        fields = parse_header(header)
+        Z, A, abundance = parse_block(body)
+        yield fields['timestep'], fields, rasterize(Z, A, abundance, DIM_N, DIM_Z, origin_N, origin_Z)
+
+
+def iter_columns(path, chunk_size=CHUNK_SIZE):
+    # lazily yields (timestep, header, Z, N, log10 abundance) for every block of the file
+    for header, body in read_blocks(path, chunk_size):
+        fields = parse_header(header)
+        Z, N, values = parse_columns(body)
+        yield fields['timestep'], fields, Z, N, values
+
+
+def split_ranges(path, parts):
+    # split the file into about `parts` byte ranges (start, end) that each begin at a 'timestep' line, so every block
+    # lies completely inside one range
+    size = os.path.getsize(path)
+    boundaries = [0]
+    with open(path, 'rb') as f:
+        for part in range(1, parts):
+            position = max(part*size//parts, boundaries[-1])
+
+            # move forward to the beginning of the next 'timestep' line:
+            f.seek(position)
+            while True:
+                buf = f.read(1024*1024)
+                if len(buf) == 0:
+                    position = size
+                    break
+                found = buf.find(b'\ntimestep')
+                if found >= 0:
+                    position += found + 1
+                    break
+                # keep the last bytes, the pattern may cross the read boundary:
+                position += max(len(buf) - len(b'\ntimestep'), 1)
+                f.seek(position)
+
+            if position > boundaries[-1]:
+                boundaries.append(position)
+
+    if boundaries[-1] < size:
+        boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _read_range_blocks(path, start, end):
+    # (header, body) of all blocks of the byte range [start, end) (see split_ranges)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        buf = f.read(end - start)
+
+    offsets = find_timestep_offsets(buf)
+    for block_start, block_end in zip(offsets, offsets[1:] + [len(buf)]):
+        yield split_block(buf[block_start:block_end])
+
+
+def parse_range(path, start, end):
+    # parse all blocks of a byte range, returns a list of (timestep, header, Z, N, log10 abundance)
+    results = []
+    for header, body in _read_range_blocks(path, start, end):
+        fields = parse_header(header)
+        Z, N, values = parse_columns(body)
+        results.append( (fields['timestep'], fields, Z, N, values) )
+    return results
+
+
+def range_extent(path, start, end):
+    # (N_min, N_max, Z_min, Z_max) of all blocks of a byte range
+    extent = None
+    for header, body in _read_range_blocks(path, start, end):
+        Z, A, abundance = parse_block(body)
+        extent = merge_extent(extent, block_extent(Z, A - Z))
+    return extent
+
+
+def _map_ranges(function, path, jobs, parts_per_job=8):
+    # run function(path, start, end) over byte ranges of the file in a process pool, results are yielded in file order.
+    # Only a window of 2*jobs ranges is in flight at a time.
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+
+    ranges = split_ranges(path, jobs*parts_per_job)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = deque()
+        for start, end in ranges:
+            pending.append(pool.submit(function, path, start, end))
+            if len(pending) >= 2*jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_columns_parallel(path, jobs):
+    # like iter_columns, but the file is split at 'timestep' lines and the ranges are parsed in a process pool,
+    # blocks are still yielded in file order
+    for results in _map_ranges(parse_range, path, jobs):
+        yield from results
+
+
+def scan_extent(path, jobs=1):
+    # (N_min, N_max, Z_min, Z_max) over all blocks of the file (None for files without data), one parse pass
+    if jobs > 1:
+        extents = _map_ranges(range_extent, path, jobs)
+    else:
+        extents = (range_extent(path, start, end) for start, end in split_ranges(path, 1))
+
+    extent = None
+    for range_result in extents:
+        extent = merge_extent(extent, range_result)
+    return extent
+
+
+class ColumnSpool:
+    # parsed blocks (timestep, Z, N, log10 abundance) in a temporary file: the grid extent is only known after the
+    # whole file has been parsed, so frames are spooled (12 bytes per isotope with float32 values) instead of parsing
+    # the text twice
+    def __init__(self, dtype=np.float32):
+        self.file = tempfile.TemporaryFile()
+        self.dtype = np.dtype(dtype)
+        self.count = 0
+
+    def append(self, timestep, Z, N, values):
+        self.file.write(np.array([timestep, len(Z)], dtype=np.int64).tobytes())
+        self.file.write(Z.astype(np.int32).tobytes())
+        self.file.write(N.astype(np.int32).tobytes())
+        self.file.write(values.astype(self.dtype).tobytes())
+        self.count += 1
+
+    def __iter__(self):
+        # yields (timestep, Z, N, values) in the order they were appended
+        self.file.seek(0)
+        for i in range(self.count):
+            timestep, length = np.frombuffer(self.file.read(16), dtype=np.int64)
+            Z = np.frombuffer(self.file.read(4*length), dtype=np.int32)
+            N = np.frombuffer(self.file.read(4*length), dtype=np.int32)
+            values = np.frombuffer(self.file.read(self.dtype.itemsize*length), dtype=self.dtype)
+            yield int(timestep), Z, N, values
+
+    def close(self):
+        self.file.close()
+
+
+# Byte-offset index of a text file, stored next to it (XTime.txt -> XTime.idx.npz). It holds offset and length of
+# every 'timestep' block plus the header values, so single frames or frame ranges can be seeked to and parsed directly.
+# The index is rebuilt when size or modification time of the text file change.
+
+def index_path(path):
+    return os.path.splitext(path)[0]+'.idx.npz'
+
+
+class BlockIndex:
+    def __init__(self, offsets, lengths, table, size, mtime_ns, extent=None):
+        self.offsets = offsets
+        self.lengths = lengths
+        self.table = table
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+        # (N_min, N_max, Z_min, Z_max) of the data, only known after data_extent() ran once:
+        self.extent = extent
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @classmethod
+    def build(cls, path, chunk_size=CHUNK_SIZE):
+        # one pass over the file, only header lines are parsed
+        stat = os.stat(path)
+        offsets = []
+        lengths = []
+        headers = []
+        with open(path, 'rb') as f:
+            for buf, start, end, buf_offset in _iter_block_spans(f, chunk_size):
+                header_end = buf.find(b'\n', start, end)
+                offsets.append(buf_offset + start)
+                lengths.append(end - start)
+                headers.append(parse_header(buf[start:header_end if header_end >= 0 else end]))
+
+        return cls(np.array(offsets, dtype=np.int64), np.array(lengths, dtype=np.int64), frametable.FrameTable.from_headers(headers), stat.st_size, stat.st_mtime_ns)
+
+    @classmethod
+    def load(cls, path):
+        # returns None if there is no index or if it is outdated
+        path_index = index_path(path)
+        if not os.path.exists(path_index):
+            return None
+
+        stat = os.stat(path)
+        with np.load(path_index) as archive:
+            if int(archive['size']) != stat.st_size or int(archive['mtime_ns']) != stat.st_mtime_ns:
+                return None
+            extent = tuple(int(value) for value in archive['extent']) if 'extent' in archive else None
+            return cls(archive['offsets'], archive['lengths'], frametable.FrameTable.from_arrays(archive), stat.st_size, stat.st_mtime_ns, extent)
+
+    def save(self, path):
+        arrays = self.table.to_arrays()
+        if self.extent is not None:
+            arrays['extent'] = np.array(self.extent, dtype=np.int64)
+
+        with open(index_path(path), 'wb') as f:
+            np.savez(f, offsets=self.offsets, lengths=self.lengths, size=np.int64(self.size), mtime_ns=np.int64(self.mtime_ns), **arrays)
+
+    def read_block(self, f, frame):
+        # (header, body) of a frame, f is the text file opened in binary mode
+        f.seek(int(self.offsets[frame]))
+        return split_block(f.read(int(self.lengths[frame])))
+
+
+def open_index(path):
+    # load the index of a text file, (re)build and store it if it is missing or outdated
+    index = BlockIndex.load(path)
+    if index is None:
+        print("Indexing",path,"...        ", end="\r", flush=True)
+        index = BlockIndex.build(path)
+        try:
+            index.save(path)
+        except OSError:
+            print("Warning: Could not write index",index_path(path))
+    return index
+
+
+def data_extent(path, jobs=1):
+    # (N_min, N_max, Z_min, Z_max) of all isotopes in the file. Found with one parse pass the first time and then
+    # carried in the byte-offset index, so later calls are free until the file changes.
+    index = open_index(path)
+    if index.extent is None:
+        print("Scanning extent of",path,"...        ", end="\r", flush=True)
+        save_extent(path, scan_extent(path, jobs), index)
+    return index.extent
+
+
+def save_extent(path, extent, index=None):
+    # store the extent of the data in the index, e.g. when it was found by a parse pass that was needed anyway
+    if index is None:
+        index = open_index(path)
+    index.extent = extent
+    if extent is not None:
+        try:
+            index.save(path)
+        except OSError:
+            print("Warning: Could not write index",index_path(path))
+
+
+def read_indexed_blocks(path, frames, index=None):
+    # like read_blocks, but only the given frames (indices into the index) are seeked to and read
+    if index is None:
+        index = open_index(path)
+
+    with open(path, 'rb') as f:
+        for frame in frames:
+            yield index.read_block(f, frame)
+
+
+def indexed_extent(path, frames, index=None):
+    # (N_min, N_max, Z_min, Z_max) of the given frames only, e.g. of a range selection. Not stored in the index.
+    extent = None
+    for header, body in read_indexed_blocks(path, frames, index):
+        Z, N, values = parse_columns(body)
+        extent = merge_extent(extent, block_extent(Z, N))
+    return extent
+
+
+def iter_indexed_timesteps(path, DIM_N, DIM_Z, frames, index=None, origin_N=0, origin_Z=0):
+    # like iter_timesteps, but only the given frames (indices into the index) are seeked to and parsed
+    if index is None:
+        index = open_index(path)
+
+    for frame, (header, body) in zip(frames, read_indexed_blocks(path, frames, index)):
+        fields = index.table.header(frame)
+        Z, A, abundance = parse_block(body)
+        yield fields['timestep'], fields, rasterize(Z, A, abundance, DIM_N, DIM_Z, origin_N, origin_Z)